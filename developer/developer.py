@@ -1,7 +1,9 @@
-import requests, os, io, zipfile, yaml
+import requests, os, io, zipfile, yaml, tempfile, uuid, hashlib
 
 SERVER_URL = "http://140.113.17.11:5000"
 GAMES_DIR = "games"
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # 打包時超過這個大小就改寫到磁碟暫存檔
+UPLOAD_BLOCK = 1 << 20            # 上傳時每次送出的大小
 
 # -------------------------
 # 帳號相關
@@ -29,18 +31,110 @@ def logout(username):
         return False
 
 # -------------------------
-# 工具：將遊戲 ZIP 到記憶體
+# 工具：將遊戲 ZIP 到暫存檔
 # -------------------------
-def zip_game_to_memory(game_dir):
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+def zip_game_to_file(game_dir):
+    """打包到 SpooledTemporaryFile：小遊戲留在記憶體，大遊戲自動改寫到磁碟"""
+    zip_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for root, _, files in os.walk(game_dir):
             for f in files:
                 file_path = os.path.join(root, f)
                 arcname = os.path.relpath(file_path, game_dir)
                 zipf.write(file_path, arcname)
-    zip_buffer.seek(0)
-    return zip_buffer
+    zip_file.seek(0)
+    return zip_file
+
+
+class MultipartStream:
+    """邊讀邊送的 multipart/form-data 請求內容
+    requests 的 files= 會把整個檔案讀進記憶體；這裡只保留表單欄位，檔案部分上傳時才逐塊讀取"""
+    def __init__(self, fields, file_field, filename, fileobj):
+        self.boundary = uuid.uuid4().hex
+        head = io.BytesIO()
+        for name, value in fields.items():
+            head.write(f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n".encode())
+            head.write(str(value).encode("utf-8") + b"\r\n")
+        head.write((f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{file_field}\"; "
+                    f"filename=\"{filename}\"\r\nContent-Type: application/zip\r\n\r\n").encode())
+        tail = f"\r\n--{self.boundary}--\r\n".encode()
+
+        fileobj.seek(0, os.SEEK_END)
+        file_size = fileobj.tell()
+        fileobj.seek(0)
+        self.parts = [io.BytesIO(head.getvalue()), fileobj, io.BytesIO(tail)]
+        self.length = len(head.getvalue()) + file_size + len(tail)
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=UPLOAD_BLOCK):
+        while self.parts:
+            data = self.parts[0].read(size)
+            if data:
+                return data
+            self.parts.pop(0)
+        return b""
+
+    def __iter__(self):
+        return iter(lambda: self.read(UPLOAD_BLOCK), b"")
+
+
+def post_zip(path, fields, game_name, zip_file):
+    """以串流方式上傳打包好的遊戲（有 Content-Length，不需 chunked）"""
+    body = MultipartStream(fields, "file", f"{game_name}.zip", zip_file)
+    return requests.post(f"{SERVER_URL}{path}", data=body, headers={"Content-Type": body.content_type})
+
+# -------------------------
+# 工具：增量更新
+# -------------------------
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_BLOCK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def build_file_list(game_dir):
+    """遊戲資料夾內每個檔案的相對路徑與 hash（略過 __pycache__）"""
+    files = []
+    for root, dirs, names in os.walk(game_dir):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for name in names:
+            path = os.path.join(root, name)
+            files.append({
+                "path": os.path.relpath(path, game_dir).replace(os.sep, "/"),
+                "size": os.path.getsize(path),
+                "sha256": file_sha256(path),
+                "local": path
+            })
+    return files
+
+def upload_changed_files(username, game_name, game_dir, data):
+    """送出檔案清單，只上傳 server 的 blob 庫沒有的檔案，再請 server 組出新版本
+    server 不支援增量更新時回傳 None"""
+    files = build_file_list(game_dir)
+    listing = [{"path": f["path"], "size": f["size"], "sha256": f["sha256"]} for f in files]
+    r = requests.post(f"{SERVER_URL}/update_game/manifest",
+                      json=dict(data, files=listing))
+    if r.status_code == 404 and not r.headers.get("Content-Type", "").startswith("application/json"):
+        return None
+    res = r.json()
+    if not res.get("success"):
+        return r
+
+    missing = set(res["missing"])
+    to_send = {f["sha256"]: f for f in files if f["sha256"] in missing}
+    print(f"共 {len(files)} 個檔案，需上傳 {len(to_send)} 個")
+    for sha256, f in to_send.items():
+        with open(f["local"], "rb") as fp:
+            r = requests.put(f"{SERVER_URL}/update_game/blob/{game_name}/{sha256}",
+                             params={"username": username}, data=fp)
+        if r.status_code != 200:
+            return r
+
+    return requests.post(f"{SERVER_URL}/update_game/commit", json=dict(data, files=listing))
 
 # -------------------------
 # 上架 / 更新 遊戲
@@ -70,9 +164,8 @@ def upload_game(username, game_name):
             print("⚠ 找不到 config.yml，跳過")
 
     # ZIP 遊戲資料夾
-    zip_buffer = zip_game_to_memory(game_dir)
+    zip_file = zip_game_to_file(game_dir)
 
-    files = {'file': (f"{game_name}.zip", zip_buffer)}
     data = {
         "username": username,
         "game_name": game_name,
@@ -83,7 +176,8 @@ def upload_game(username, game_name):
         "config": config_data
     }
 
-    r = requests.post(f"{SERVER_URL}/upload_game", files=files, data=data)
+    with zip_file:
+        r = post_zip("/upload_game", data, game_name, zip_file)
     print(r.text)
 
 def update_game(username, game_name):
@@ -113,9 +207,6 @@ def update_game(username, game_name):
         else:
             print("⚠ 找不到 config.yml，跳過")
 
-    # 打包遊戲成 zip
-    zip_buffer = zip_game_to_memory(game_dir)
-    files = {'file': (f"{game_name}.zip", zip_buffer)}
     data = {
         "username": username,
         "game_name": game_name,
@@ -126,8 +217,11 @@ def update_game(username, game_name):
         "config": config_data
     }
 
-    # 呼叫 server 更新遊戲
-    r = requests.post(f"{SERVER_URL}/update_game", files=files, data=data)
+    # 先嘗試增量更新（只上傳 server 沒有的檔案），server 不支援時改為上傳完整 zip
+    r = upload_changed_files(username, game_name, game_dir, data)
+    if r is None:
+        with zip_game_to_file(game_dir) as zip_file:
+            r = post_zip("/update_game", data, game_name, zip_file)
     print(r.text)
 
 def remove_game(username, game_name):
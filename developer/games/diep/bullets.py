@@ -0,0 +1,162 @@
+# 子彈儲存與物理更新
+# 有 NumPy 時使用 struct-of-arrays 向量化計算，沒有時退回純 Python（搭配空間格子）
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from spatial import SpatialGrid
+
+
+class PyBulletStore:
+    """純 Python 版本：子彈為 dict list，逐顆移動並用空間格子找碰撞對象"""
+    def __init__(self, map_w, map_h, player_range, block_range, cell_size):
+        self.map_w, self.map_h = map_w, map_h
+        self.player_range = player_range
+        self.block_range = block_range
+        self.player_grid = SpatialGrid(cell_size)
+        self.bullets = []
+
+    def __len__(self):
+        return len(self.bullets)
+
+    def add(self, bid, x, y, dx, dy, team, owner):
+        self.bullets.append({"id": bid, "x": x, "y": y, "dx": dx, "dy": dy, "team": team, "owner": owner})
+
+    def snapshot(self):
+        return {
+            str(b["id"]): {"x": b["x"], "y": b["y"], "dx": b["dx"], "dy": b["dy"], "team": b["team"]}
+            for b in self.bullets
+        }
+
+    def step(self, players, blocks, block_grid):
+        """移動子彈並移除出界 / 命中的子彈
+        players 為 [(pid, p), ...]；回傳依子彈順序排列的命中事件 [(owner, "player"|"block", index)]"""
+        self.player_grid.clear()
+        for i, (pid, p) in enumerate(players):
+            self.player_grid.insert(i, p["x"], p["y"])
+
+        hits = []
+        alive = []
+        for b in self.bullets:
+            b["x"] += b["dx"]
+            b["y"] += b["dy"]
+            if not (0 <= b["x"] <= self.map_w and 0 <= b["y"] <= self.map_h):
+                continue
+
+            hit = None
+            for i in self.player_grid.query(b["x"], b["y"], self.player_range):
+                p = players[i][1]
+                if p["team"] != b["team"] and abs(p["x"]-b["x"]) < self.player_range and abs(p["y"]-b["y"]) < self.player_range:
+                    hit = (b["owner"], "player", i)
+                    break
+
+            if hit is None:
+                for i in block_grid.query(b["x"], b["y"], self.block_range):
+                    blk = blocks[i]
+                    if abs(blk["x"]-b["x"]) < self.block_range and abs(blk["y"]-b["y"]) < self.block_range:
+                        hit = (b["owner"], "block", i)
+                        break
+
+            if hit is None:
+                alive.append(b)
+            else:
+                hits.append(hit)
+
+        self.bullets = alive
+        return hits
+
+
+class NumpyBulletStore:
+    """NumPy 版本：x / y / dx / dy / team / owner 各自一個 array，整批移動、裁切與碰撞"""
+    def __init__(self, map_w, map_h, player_range, block_range, capacity=256):
+        self.map_w, self.map_h = map_w, map_h
+        self.player_range = player_range
+        self.block_range = block_range
+        self.n = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old = getattr(self, "ids", None)
+        fields = {"ids": np.int64, "x": np.float64, "y": np.float64,
+                  "dx": np.float64, "dy": np.float64, "team": np.int64, "owner": np.int64}
+        for name, dtype in fields.items():
+            arr = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                arr[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, arr)
+
+    def __len__(self):
+        return self.n
+
+    def add(self, bid, x, y, dx, dy, team, owner):
+        if self.n == len(self.ids):
+            self._alloc(len(self.ids) * 2)
+        i = self.n
+        self.ids[i], self.x[i], self.y[i] = bid, x, y
+        self.dx[i], self.dy[i] = dx, dy
+        self.team[i], self.owner[i] = team, owner
+        self.n += 1
+
+    def snapshot(self):
+        n = self.n
+        return {
+            str(bid): {"x": x, "y": y, "dx": dx, "dy": dy, "team": team}
+            for bid, x, y, dx, dy, team in zip(
+                self.ids[:n].tolist(), self.x[:n].tolist(), self.y[:n].tolist(),
+                self.dx[:n].tolist(), self.dy[:n].tolist(), self.team[:n].tolist())
+        }
+
+    def _first_hit(self, x, y, mask, tx, ty, hit_range):
+        """每顆子彈命中的第一個目標 index（沒有命中為 -1）"""
+        m = mask & (np.abs(x[:, None] - tx[None, :]) < hit_range) & (np.abs(y[:, None] - ty[None, :]) < hit_range)
+        return np.where(m.any(axis=1), m.argmax(axis=1), -1)
+
+    def step(self, players, blocks, block_grid):
+        """介面同 PyBulletStore.step；block_grid 不使用，改以整批比對"""
+        n = self.n
+        if n == 0:
+            return []
+        x, y = self.x[:n], self.y[:n]
+        x += self.dx[:n]
+        y += self.dy[:n]
+        inside = (x >= 0) & (x <= self.map_w) & (y >= 0) & (y <= self.map_h)
+
+        player_hit = np.full(n, -1)
+        if players:
+            px = np.array([p["x"] for _, p in players], dtype=np.float64)
+            py = np.array([p["y"] for _, p in players], dtype=np.float64)
+            pteam = np.array([p["team"] for _, p in players])
+            mask = inside[:, None] & (self.team[:n, None] != pteam[None, :])
+            player_hit = self._first_hit(x, y, mask, px, py, self.player_range)
+
+        block_hit = np.full(n, -1)
+        if blocks:
+            bx = np.array([blk["x"] for blk in blocks], dtype=np.float64)
+            by = np.array([blk["y"] for blk in blocks], dtype=np.float64)
+            mask = (inside & (player_hit < 0))[:, None]
+            block_hit = self._first_hit(x, y, mask, bx, by, self.block_range)
+
+        hits = []
+        owners = self.owner[:n]
+        for i in np.flatnonzero((player_hit >= 0) | (block_hit >= 0)).tolist():
+            if player_hit[i] >= 0:
+                hits.append((int(owners[i]), "player", int(player_hit[i])))
+            else:
+                hits.append((int(owners[i]), "block", int(block_hit[i])))
+
+        keep = inside & (player_hit < 0) & (block_hit < 0)
+        k = int(keep.sum())
+        if k != n:
+            for name in ("ids", "x", "y", "dx", "dy", "team", "owner"):
+                arr = getattr(self, name)
+                arr[:k] = arr[:n][keep]
+            self.n = k
+        return hits
+
+
+def make_bullet_store(map_w, map_h, player_range, block_range, cell_size, use_numpy=True):
+    if use_numpy and np is not None:
+        return NumpyBulletStore(map_w, map_h, player_range, block_range)
+    return PyBulletStore(map_w, map_h, player_range, block_range, cell_size)
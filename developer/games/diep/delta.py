@@ -0,0 +1,77 @@
+# diep 狀態的 keyframe / delta 編碼（server 與 client 共用）
+# state = {"players": {id: {...}}, "bullets": {id: {...}}, "blocks": {id: {...}}}，id 一律為字串
+
+ENTITY_KINDS = ("players", "bullets", "blocks")
+
+
+def diff_fields(old, new):
+    """players / blocks：新出現的實體送完整內容，既有實體只送有變動的欄位"""
+    changed = {}
+    for eid, ent in new.items():
+        prev = old.get(eid)
+        if prev is None:
+            changed[eid] = ent
+            continue
+        fields = {k: v for k, v in ent.items() if prev.get(k) != v}
+        if fields:
+            changed[eid] = fields
+    removed = [eid for eid in old if eid not in new]
+    return changed, removed
+
+
+def diff_bullets(old, new):
+    """子彈為等速直線運動，client 會自行推進位置，只需送新增與消失的子彈"""
+    added = {bid: b for bid, b in new.items() if bid not in old}
+    removed = [bid for bid in old if bid not in new]
+    return added, removed
+
+
+def make_delta(old, new):
+    delta = {}
+    for kind in ENTITY_KINDS:
+        differ = diff_bullets if kind == "bullets" else diff_fields
+        changed, removed = differ(old[kind], new[kind])
+        part = {}
+        if changed:
+            part["set"] = changed
+        if removed:
+            part["del"] = removed
+        if part:
+            delta[kind] = part
+    return delta
+
+
+def apply_delta(state, delta):
+    """把一個 tick 的 delta 套到 state 上（原地修改）"""
+    for b in state["bullets"].values():
+        b["x"] += b["dx"]
+        b["y"] += b["dy"]
+
+    for kind in ENTITY_KINDS:
+        part = delta.get(kind)
+        if not part:
+            continue
+        entities = state[kind]
+        for eid in part.get("del", []):
+            entities.pop(eid, None)
+        for eid, fields in part.get("set", {}).items():
+            entities.setdefault(eid, {}).update(fields)
+
+
+def make_keyframe(state):
+    """完整狀態；bullets / blocks 以 list 送出，維持舊版 update 訊息的格式"""
+    return {
+        "players": state["players"],
+        "bullets": [dict(b, id=bid) for bid, b in state["bullets"].items()],
+        "blocks": [dict(blk, id=bid) for bid, blk in state["blocks"].items()],
+    }
+
+
+def state_from_keyframe(data):
+    state = {"players": {str(pid): dict(p) for pid, p in data["players"].items()}}
+    for kind in ("bullets", "blocks"):
+        state[kind] = {}
+        for ent in data[kind]:
+            ent = dict(ent)
+            state[kind][str(ent.pop("id"))] = ent
+    return state
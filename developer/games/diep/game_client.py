@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 import socket, json, threading, pygame, argparse, time, sys
+from protocol import LineReader, recv_line
+from delta import apply_delta, state_from_keyframe
+from wire import read_frame
 
 # ----------------- 通訊函數 -----------------
 def send_line(sock, obj):
@@ -7,20 +10,9 @@ def send_line(sock, obj):
         sock.sendall((json.dumps(obj) + "\n").encode())
     except: pass
 
-def recv_line(sock):
-    buf = b""
-    while True:
-        ch = sock.recv(1)
-        if not ch: return None
-        if ch == b"\n": break
-        buf += ch
-    try:
-        return json.loads(buf.decode())
-    except: return None
-
 # ----------------- 客戶端類別 -----------------
 class GameClient:
-    def __init__(self, host, port, username, retry=5, delay=0.5):
+    def __init__(self, host, port, username, retry=5, delay=0.5, encoding="binary"):
         self.host = host
         self.port = port
 
@@ -38,8 +30,11 @@ class GameClient:
                     sys.exit(1)
                 time.sleep(delay)
 
-        # 送 join 訊息
-        send_line(self.sock, {"type":"join","data":{"username":username}})
+        self.reader = LineReader(self.sock)
+
+        # 送 join 訊息（encoding 為希望 server 使用的狀態格式，server 以 welcome 回覆實際採用的格式）
+        send_line(self.sock, {"type":"join","data":{"username":username,"encoding":encoding}})
+        self.binary = False
 
         # 初始化資料
         self.player_id = None
@@ -48,6 +43,11 @@ class GameClient:
         self.blocks = []
         self.map_w, self.map_h = 2000, 2000
 
+        # delta 同步狀態：seq 為最後套用的 tick 序號
+        self.state = None
+        self.seq = None
+        self.resync_sent = False
+
         # Pygame 初始化
         pygame.init()
         self.screen_w, self.screen_h = 800, 600
@@ -64,19 +64,33 @@ class GameClient:
     # ----------------- 接收訊息 -----------------
     def recv_loop(self):
         while self.running:
-            msg = recv_line(self.sock)
+            msg = read_frame(self.reader) if self.binary else recv_line(self.reader)
             if not msg:
                 break
             if msg["type"] == "welcome":
                 self.player_id = msg["data"]["player"]
                 self.map_w = msg["data"]["map_w"]
                 self.map_h = msg["data"]["map_h"]
+                # 舊版 server 不會回 encoding，維持 JSON
+                self.binary = msg["data"].get("encoding") == "binary"
                 print(f"[client] Welcome! Player id = {self.player_id}")
             elif msg["type"] == "update":
-                # 將 players 的 key 轉成 int，避免字串/整數不一致
-                self.players = {int(pid): p for pid, p in msg["data"]["players"].items()}
-                self.bullets = msg["data"]["bullets"]
-                self.blocks = msg["data"]["blocks"]
+                # keyframe：以完整狀態重建
+                self.state = state_from_keyframe(msg["data"])
+                self.seq = msg["data"].get("seq")
+                self.resync_sent = False
+                self.publish_state()
+            elif msg["type"] == "delta":
+                seq = msg["data"].get("seq")
+                if self.state is None or self.seq is None or seq != self.seq + 1:
+                    # 漏掉 delta → 要求 server 送 keyframe，期間忽略後續 delta
+                    if not self.resync_sent:
+                        send_line(self.sock, {"type":"resync","data":{}})
+                        self.resync_sent = True
+                    continue
+                apply_delta(self.state, msg["data"])
+                self.seq = seq
+                self.publish_state()
             elif msg["type"] == "dead":
                 print(msg["data"].get("message", "You are dead."))
                 self.running = False
@@ -86,6 +100,12 @@ class GameClient:
                     pass
                 break
 
+    def publish_state(self):
+        # 給繪圖用的複本；將 players 的 key 轉成 int，避免字串/整數不一致
+        self.players = {int(pid): dict(p) for pid, p in self.state["players"].items()}
+        self.bullets = list(self.state["bullets"].values())
+        self.blocks = list(self.state["blocks"].values())
+
     # ----------------- 攝影機跟隨 -----------------
     def update_camera(self):
         # 確認 player_id 在 players 裡
@@ -180,5 +200,6 @@ if __name__=="__main__":
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=9002)
     parser.add_argument("--username", default="p1")
+    parser.add_argument("--encoding", choices=["binary", "json"], default="binary")
     args = parser.parse_args()
-    GameClient(args.host, args.port, args.username)
+    GameClient(args.host, args.port, args.username, encoding=args.encoding)
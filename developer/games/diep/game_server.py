@@ -1,4 +1,9 @@
-import socket, threading, json, time, random
+import asyncio, time, random, itertools
+from aio import Outbox, recv_json, encode_line, tick_loop
+from delta import make_delta, make_keyframe
+from spatial import SpatialGrid
+from bullets import make_bullet_store
+import wire
 
 MAP_WIDTH, MAP_HEIGHT = 2000, 2000
 TICK = 0.03
@@ -10,98 +15,120 @@ MIN_SHOT_INTERVAL = 0.1
 EXP_PER_KILL = 20
 EXP_PER_BLOCK = 5
 LEVEL_UP_EXP = 100
+KEYFRAME_INTERVAL = 100  # 每幾個 tick 送一次完整狀態，其餘 tick 只送 delta
+PLAYER_HIT_RANGE = 15
+BLOCK_HIT_RANGE = 20
+GRID_CELL_SIZE = 20      # 碰撞用空間格子大小（約等於 hit box）
 
-def send_line(conn, obj):
-    try:
-        conn.sendall((json.dumps(obj) + "\n").encode())
-    except: pass
+class ClientOutbox(Outbox):
+    """binary 表示此 client 在 join 時選擇了二進位 frame（見 wire.py），否則為 JSON lines"""
+    def __init__(self, writer, binary=False):
+        super().__init__(writer)
+        self.binary = binary
 
-def recv_line(conn):
-    buf = b""
-    while True:
-        try: ch = conn.recv(1)
-        except: return None
-        if not ch: return None
-        if ch == b"\n": break
-        buf += ch
-    try: return json.loads(buf.decode())
-    except: return None
+    def encode(self, obj):
+        return wire.encode_message(obj) if self.binary else encode_line(obj)
 
 class GameServer:
-    def __init__(self, host="0.0.0.0", port=9001, max_players=4):
+    # 所有連線與 tick 都跑在同一個 asyncio event loop 上，狀態不需要上鎖
+    def __init__(self, host="0.0.0.0", port=9001, max_players=4, use_numpy=True):
         self.host = host
         self.port = port
         self.max_players = max_players
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.clients = []
+        self.outboxes = {}  # writer -> ClientOutbox
         self.players = {}  # pid -> dict
-        self.bullets = []
+        self.bullets = make_bullet_store(MAP_WIDTH, MAP_HEIGHT, PLAYER_HIT_RANGE, BLOCK_HIT_RANGE,
+                                         GRID_CELL_SIZE, use_numpy=use_numpy)
         self.blocks = []
         self.next_id = 1
-        self.lock = threading.RLock()
+        self.bullet_ids = itertools.count(1)
         self.running = True
+        self.loop = None
+
+        # 狀態同步：seq 為 tick 序號，need_keyframe 中的 client 下個 tick 改送完整狀態
+        self.seq = 0
+        self.last_snapshot = {"players": {}, "bullets": {}, "blocks": {}}
+        self.need_keyframe = set()
+
+        # 方塊碰撞用空間索引：方塊只在重生時移動，增量更新
+        self.block_grid = SpatialGrid(GRID_CELL_SIZE)
 
         # 初始化方塊
-        for _ in range(30):
+        for i in range(30):
             self.blocks.append({"x": random.randint(0, MAP_WIDTH-40),
                                 "y": random.randint(0, MAP_HEIGHT-40),
                                 "hp": 100})
+            self.block_grid.insert(i, self.blocks[i]["x"], self.blocks[i]["y"])
 
     def start(self):
-        self.server.bind((self.host, self.port))
-        self.server.listen(self.max_players)
-        print(f"[Server] Listening {self.host}:{self.port}")
-
-        threading.Thread(target=self.accept_loop, daemon=True).start()
-        threading.Thread(target=self.update_loop, daemon=True).start()
-
         try:
-            while True: time.sleep(1)
+            asyncio.run(self.serve())
         except KeyboardInterrupt:
             print("[Server] Shutting down...")
-            self.running = False
-            self.server.close()
-
-    def accept_loop(self):
-        while self.running and len(self.clients) < self.max_players:
-            conn, addr = self.server.accept()
-            join = recv_line(conn)
-            if join is None or join.get("type") != "join":
-                conn.close()
-                continue
-            username = join["data"].get("username", str(addr))
-
-            with self.lock:
-                pid = self.next_id
-                self.next_id += 1
-                team = 1 if pid % 2 == 1 else 2
-                self.players[pid] = {
-                    "conn": conn,
-                    "username": username,
-                    "x": random.randint(50, MAP_WIDTH-50),
-                    "y": random.randint(50, MAP_HEIGHT-50),
-                    "hp": 100,
-                    "team": team,
-                    "last_shot": 0
-                }
-                self.clients.append(conn)
 
-            send_line(conn, {"type":"welcome","data":{"player":pid,"map_w":MAP_WIDTH,"map_h":MAP_HEIGHT}})
-            print(f"[Server] {username} joined as player {pid}, team {team}")
-
-            # 每個 client 對應一個 thread
-            threading.Thread(target=self.client_loop, args=(pid, conn), daemon=True).start()
+    def stop(self):
+        """由 game host 從其他 thread 呼叫（房間被刪除或超過時間上限）：結束遊戲並中斷所有連線"""
+        self.running = False
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._abort_clients)
+            except RuntimeError:
+                pass  # event loop 已結束
+
+    def _abort_clients(self):
+        for outbox in list(self.outboxes.values()):
+            outbox.abort()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"[Server] Listening {self.host}:{self.port}")
+        async with server:
+            await tick_loop(TICK, self.update, lambda: self.running)
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        join = await recv_json(reader)
+        if join is None or join.get("type") != "join" or len(self.players) >= self.max_players:
+            writer.close()
+            return
+        username = join["data"].get("username", str(addr))
+        binary = join["data"].get("encoding") == "binary"
+
+        pid = self.next_id
+        self.next_id += 1
+        team = 1 if pid % 2 == 1 else 2
+        self.players[pid] = {
+            "conn": writer,
+            "username": username,
+            "x": random.randint(50, MAP_WIDTH-50),
+            "y": random.randint(50, MAP_HEIGHT-50),
+            "hp": 100,
+            "team": team,
+            "last_shot": 0
+        }
+        # welcome 一律為 JSON line 且必須在第一個狀態 frame 之前進入佇列，之後才切換成協商的格式
+        outbox = ClientOutbox(writer, binary=binary)
+        outbox.put(encode_line({"type":"welcome","data":{"player":pid,"map_w":MAP_WIDTH,"map_h":MAP_HEIGHT,
+                                                         "encoding":"binary" if binary else "json"}}))
+        self.outboxes[writer] = outbox
+        self.need_keyframe.add(writer)
+        print(f"[Server] {username} joined as player {pid}, team {team}")
 
-    def client_loop(self, pid, conn):
         while self.running:
-            msg = recv_line(conn)
+            msg = await recv_json(reader)
             if not msg: break
+            if msg.get("type") == "resync":
+                # client 漏接 delta，要求重送完整狀態
+                self.need_keyframe.add(writer)
+                continue
             self.handle_move(pid, msg)
+
         # 玩家斷線
-        with self.lock:
-            if pid in self.players: del self.players[pid]
-            if conn in self.clients: self.clients.remove(conn)
-            conn.close()
+        if pid in self.players: del self.players[pid]
+        self.need_keyframe.discard(writer)
+        outbox = self.outboxes.pop(writer, None)
+        if outbox: outbox.close()
         print(f"[Server] Player {pid} disconnected")
 
     def handle_move(self, pid, msg):
@@ -133,14 +160,7 @@ class GameServer:
                 my = msg["data"]["my"]
                 dx_b = (mx - p["x"]) / BULLET_SPEED
                 dy_b = (my - p["y"]) / BULLET_SPEED
-                self.bullets.append({
-                    "x": p["x"],
-                    "y": p["y"],
-                    "dx": dx_b,
-                    "dy": dy_b,
-                    "team": p["team"],
-                    "owner": pid
-                })
+                self.bullets.add(next(self.bullet_ids), p["x"], p["y"], dx_b, dy_b, p["team"], pid)
                 p["last_shot"] = now
 
         # ------------------ 升級判斷 ------------------
@@ -155,102 +175,100 @@ class GameServer:
             else:
                 p["shot_interval"] = max(MIN_SHOT_INTERVAL, p["shot_interval"] * 0.9)
 
-    def update_loop(self):
-        while self.running:
-            with self.lock:
-                # 移動子彈
-                new_bullets = []
-                for b in self.bullets:
-                    b["x"] += b["dx"]
-                    b["y"] += b["dy"]
-                    if not (0 <= b["x"] <= MAP_WIDTH and 0 <= b["y"] <= MAP_HEIGHT):
-                        continue
-
-                    hit = False
-
-                    # 玩家碰撞
-                    for pid, p in self.players.items():
-                        if p["team"] != b["team"] and abs(p["x"]-b["x"])<15 and abs(p["y"]-b["y"])<15:
-                            p["hp"] -= 10
-                            owner = b.get("owner")
-                            if owner in self.players and p["hp"] <= 0:
-                                self.players[owner]["exp"] = self.players[owner].get("exp",0) + 50
-                            hit = True
-                            break
-
-                    # 方塊碰撞
-                    if not hit:
-                        for blk in self.blocks:
-                            if abs(blk["x"]-b["x"])<20 and abs(blk["y"]-b["y"])<20:
-                                blk["hp"] -= 10
-                                owner = b.get("owner")
-                                if owner in self.players and blk["hp"] <= 0:
-                                    self.players[owner]["exp"] = self.players[owner].get("exp",0) + 10
-                                hit = True
-                                break
-
-                    if not hit:
-                        new_bullets.append(b)
-
-                self.bullets = new_bullets
-
-                # 方塊重生
-                for blk in self.blocks:
-                    if blk["hp"] <= 0:
-                        blk["x"] = random.randint(0, MAP_WIDTH-40)
-                        blk["y"] = random.randint(0, MAP_HEIGHT-40)
-                        blk["hp"] = 100
-
-                # 玩家死亡
-                for pid, p in list(self.players.items()):
-                    if p["hp"] <= 0:
-                        try:
-                            send_line(p["conn"], {"type":"dead","data":{"message":"你已死亡"}})
-                        except: pass
-                        if p["conn"] in self.clients:
-                            self.clients.remove(p["conn"])
-                        del self.players[pid]
-
-                # 玩家經驗與升級
-                for pid, p in self.players.items():
-                    p["exp"] = p.get("exp",0)
-                    p["level"] = p.get("level",1)
-                    p["speed"] = p.get("speed",5)
-                    p["shot_interval"] = p.get("shot_interval",SHOT_INTERVAL)
-
-                    if p["exp"] >= LEVEL_UP_EXP * p["level"]:
-                        p["level"] += 1
-                        # 隨機升級: 移動速度或射速
-                        choice = random.choice(["speed","shot"])
-                        if choice=="speed":
-                            p["speed"] = min(MAX_SPEED, p["speed"]+1)
-                        else:
-                            p["shot_interval"] = max(MIN_SHOT_INTERVAL, p["shot_interval"]*0.9)
-
-                # 廣播狀態給所有玩家
-                state = {
-                    "type": "update",
-                    "data": {
-                        "players": {
-                            pid: {
-                                "x": p["x"],
-                                "y": p["y"],
-                                "hp": p["hp"],
-                                "team": p["team"],
-                                "exp": p["exp"],
-                                "level": p["level"],
-                                "speed": p["speed"],
-                                "shot_interval": p["shot_interval"]
-                            } for pid, p in self.players.items()
-                        },
-                        "bullets": self.bullets,
-                        "blocks": self.blocks
-                    }
-                }
-                for c in self.clients:
-                    send_line(c, state)
-
-            time.sleep(TICK)
+    def snapshot(self):
+        """目前狀態的複本（id 皆轉成字串），供計算 delta 使用"""
+        return {
+            "players": {
+                str(pid): {
+                    "x": p["x"],
+                    "y": p["y"],
+                    "hp": p["hp"],
+                    "team": p["team"],
+                    "exp": p["exp"],
+                    "level": p["level"],
+                    "speed": p["speed"],
+                    "shot_interval": p["shot_interval"]
+                } for pid, p in self.players.items()
+            },
+            "bullets": self.bullets.snapshot(),
+            "blocks": {
+                str(i): {"x": blk["x"], "y": blk["y"], "hp": blk["hp"]}
+                for i, blk in enumerate(self.blocks)
+            }
+        }
+
+    def encode_frame(self, snapshot, delta, binary, keyframe):
+        if binary:
+            if keyframe:
+                return wire.encode_keyframe(snapshot, self.seq)
+            return wire.encode_delta(delta, snapshot, self.seq)
+        if keyframe:
+            return encode_line({"type": "update", "data": dict(make_keyframe(snapshot), seq=self.seq)})
+        return encode_line({"type": "delta", "data": dict(delta, seq=self.seq)})
+
+    def update(self):
+        # 移動子彈並找出命中對象（依子彈順序結算傷害）
+        player_order = list(self.players.items())
+        hits = self.bullets.step(player_order, self.blocks, self.block_grid)
+        for owner, kind, i in hits:
+            if kind == "player":
+                target, reward = player_order[i][1], 50
+            else:
+                target, reward = self.blocks[i], 10
+            target["hp"] -= 10
+            if owner in self.players and target["hp"] <= 0:
+                self.players[owner]["exp"] = self.players[owner].get("exp",0) + reward
+
+        # 方塊重生
+        for i, blk in enumerate(self.blocks):
+            if blk["hp"] <= 0:
+                self.block_grid.remove(i, blk["x"], blk["y"])
+                blk["x"] = random.randint(0, MAP_WIDTH-40)
+                blk["y"] = random.randint(0, MAP_HEIGHT-40)
+                blk["hp"] = 100
+                self.block_grid.insert(i, blk["x"], blk["y"])
+
+        # 玩家死亡
+        for pid, p in list(self.players.items()):
+            if p["hp"] <= 0:
+                outbox = self.outboxes.pop(p["conn"], None)
+                if outbox:
+                    # 佇列滿（client 來不及收）時也要送出死亡通知再關閉
+                    outbox.close({"type":"dead","data":{"message":"你已死亡"}})
+                del self.players[pid]
+
+        # 玩家經驗與升級
+        for pid, p in self.players.items():
+            p["exp"] = p.get("exp",0)
+            p["level"] = p.get("level",1)
+            p["speed"] = p.get("speed",5)
+            p["shot_interval"] = p.get("shot_interval",SHOT_INTERVAL)
+
+            if p["exp"] >= LEVEL_UP_EXP * p["level"]:
+                p["level"] += 1
+                # 隨機升級: 移動速度或射速
+                choice = random.choice(["speed","shot"])
+                if choice=="speed":
+                    p["speed"] = min(MAX_SPEED, p["speed"]+1)
+                else:
+                    p["shot_interval"] = max(MIN_SHOT_INTERVAL, p["shot_interval"]*0.9)
+
+        # 廣播狀態給所有玩家：每種 frame（格式 × keyframe/delta）只編碼一次，同一份 bytes 放進每個 client 的送出佇列
+        snapshot = self.snapshot()
+        self.seq += 1
+        full_tick = self.seq % KEYFRAME_INTERVAL == 0
+        delta = make_delta(self.last_snapshot, snapshot)
+        frames = {}
+        dropped = []
+        for writer, outbox in self.outboxes.items():
+            key = (outbox.binary, full_tick or writer in self.need_keyframe)
+            if key not in frames:
+                frames[key] = self.encode_frame(snapshot, delta, *key)
+            if not outbox.put(frames[key]):
+                dropped.append(writer)
+        # 被丟掉的 frame 會讓 client 的 seq 斷掉，下個 tick 直接補 keyframe
+        self.need_keyframe = set(dropped)
+        self.last_snapshot = snapshot
 
 if __name__=="__main__":
     import argparse
@@ -258,6 +276,7 @@ if __name__=="__main__":
     parser.add_argument("--host", default="0.0.0.0")
     parser.add_argument("--port", type=int, default=9002)
     parser.add_argument("--max_players", type=int, default=4)
+    parser.add_argument("--no_numpy", action="store_true", help="不使用 NumPy 向量化子彈運算")
     args = parser.parse_args()
-    gs = GameServer(host=args.host, port=args.port, max_players=args.max_players)
+    gs = GameServer(host=args.host, port=args.port, max_players=args.max_players, use_numpy=not args.no_numpy)
     gs.start()
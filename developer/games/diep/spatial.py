@@ -0,0 +1,38 @@
+# 均勻格子的空間索引：物件依座標放進 cell_size 大小的格子，
+# 碰撞檢查只需看子彈附近的幾個格子，而不是掃過所有玩家 / 方塊
+
+
+class SpatialGrid:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> [key, ...]
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, key, x, y):
+        self.cells.setdefault(self._cell(x, y), []).append(key)
+
+    def remove(self, key, x, y):
+        cell_key = self._cell(x, y)
+        cell = self.cells.get(cell_key)
+        if cell and key in cell:
+            cell.remove(key)
+            if not cell:
+                del self.cells[cell_key]
+
+    def query(self, x, y, radius):
+        """回傳所有可能落在 (x, y) 周圍 radius 範圍內的 key，依 key 排序以保持原本的檢查順序"""
+        x0, y0 = self._cell(x - radius, y - radius)
+        x1, y1 = self._cell(x + radius, y + radius)
+        found = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.extend(cell)
+        found.sort()
+        return found
@@ -0,0 +1,106 @@
+# diep 的二進位 frame 格式（join 時以 "encoding": "binary" 協商，否則維持 JSON lines）
+#
+# frame   = u32 body 長度 + body
+# body    = u8 種類 + u32 seq + payload
+# 狀態 payload 依序為 players / bullets / blocks 三段，每段 = u32 筆數 + 固定長度紀錄 + u32 筆數 + 被刪除的 id（u32）
+# keyframe 與 delta 格式相同：keyframe 的紀錄包含所有實體，delta 只包含新增或有變動的實體（整筆送出）
+import json, struct
+
+LENGTH = struct.Struct("<I")
+HEADER = struct.Struct("<BI")
+COUNT = struct.Struct("<I")
+
+FRAME_KEYFRAME = 0
+FRAME_DELTA = 1
+FRAME_MESSAGE = 2  # 其他訊息（dead 等），payload 為 JSON
+
+# 每種實體的固定欄位：(id, 欄位...)
+RECORDS = {
+    "players": (struct.Struct("<Iddiiiiid"),
+                ("x", "y", "hp", "team", "exp", "level", "speed", "shot_interval")),
+    "bullets": (struct.Struct("<Iddddi"), ("x", "y", "dx", "dy", "team")),
+    "blocks": (struct.Struct("<Iiii"), ("x", "y", "hp")),
+}
+ENTITY_KINDS = ("players", "bullets", "blocks")
+
+
+def _frame(kind, seq, payload):
+    body = HEADER.pack(kind, seq) + payload
+    return LENGTH.pack(len(body)) + body
+
+
+def _encode_entities(snapshot, changes):
+    parts = []
+    for kind in ENTITY_KINDS:
+        record, fields = RECORDS[kind]
+        entities = snapshot[kind]
+        set_ids, del_ids = changes.get(kind, ((), ()))
+        parts.append(COUNT.pack(len(set_ids)))
+        parts.extend(record.pack(int(eid), *(entities[eid][f] for f in fields)) for eid in set_ids)
+        parts.append(COUNT.pack(len(del_ids)))
+        parts.append(struct.pack(f"<{len(del_ids)}I", *map(int, del_ids)))
+    return b"".join(parts)
+
+
+def encode_keyframe(snapshot, seq):
+    changes = {kind: (list(snapshot[kind]), ()) for kind in ENTITY_KINDS}
+    return _frame(FRAME_KEYFRAME, seq, _encode_entities(snapshot, changes))
+
+
+def encode_delta(delta, snapshot, seq):
+    """delta 為 make_delta 的結果；有變動的實體從 snapshot 取出完整紀錄"""
+    changes = {}
+    for kind, part in delta.items():
+        changes[kind] = (list(part.get("set", {})), part.get("del", []))
+    return _frame(FRAME_DELTA, seq, _encode_entities(snapshot, changes))
+
+
+def encode_message(obj):
+    return _frame(FRAME_MESSAGE, 0, json.dumps(obj, separators=(',', ':')).encode())
+
+
+def _decode_entities(body, offset):
+    result = {}
+    for kind in ENTITY_KINDS:
+        record, fields = RECORDS[kind]
+        (count,) = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        changed = {}
+        for values in record.iter_unpack(body[offset:offset + count * record.size]):
+            changed[str(values[0])] = dict(zip(fields, values[1:]))
+        offset += count * record.size
+        (count,) = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        removed = [str(eid) for eid in struct.unpack_from(f"<{count}I", body, offset)]
+        offset += count * 4
+        result[kind] = (changed, removed)
+    return result
+
+
+def decode_frame(body):
+    """把 frame body 轉回與 JSON 版本相同結構的訊息 dict"""
+    kind, seq = HEADER.unpack_from(body)
+    if kind == FRAME_MESSAGE:
+        return json.loads(body[HEADER.size:])
+
+    entities = _decode_entities(body, HEADER.size)
+    if kind == FRAME_KEYFRAME:
+        players = entities["players"][0]
+        bullets = [dict(b, id=bid) for bid, b in entities["bullets"][0].items()]
+        blocks = [dict(blk, id=bid) for bid, blk in entities["blocks"][0].items()]
+        return {"type": "update", "data": {"players": players, "bullets": bullets, "blocks": blocks, "seq": seq}}
+
+    data = {kind: {"set": changed, "del": removed} for kind, (changed, removed) in entities.items()}
+    data["seq"] = seq
+    return {"type": "delta", "data": data}
+
+
+def read_frame(reader):
+    """從 LineReader 讀取一個 frame；連線關閉時回傳 None"""
+    header = reader.readexactly(LENGTH.size)
+    if header is None:
+        return None
+    body = reader.readexactly(LENGTH.unpack(header)[0])
+    if body is None:
+        return None
+    return decode_frame(body)
@@ -1,23 +1,10 @@
 #!/usr/bin/env python3
 import socket, json, argparse, threading, tkinter as tk, sys
+from protocol import LineReader, recv_line
 
 def send_line(s, obj):
     s.sendall((json.dumps(obj, separators=(',', ':')) + "\n").encode('utf-8'))
 
-def recv_line(s):
-    buf = b""
-    while True:
-        ch = s.recv(1)
-        if not ch:
-            return None
-        if ch == b"\n":
-            break
-        buf += ch
-    try:
-        return json.loads(buf.decode('utf-8'))
-    except:
-        return None
-
 
 class GomokuClient:
     def __init__(self, host, port, username, cell=30, margin=20):
@@ -26,6 +13,7 @@ class GomokuClient:
         self.username = username
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reader = LineReader(self.sock)
         self.player = None
         self.board_size = 15
         self.board = [[0]*self.board_size for _ in range(self.board_size)]
@@ -67,7 +55,7 @@ class GomokuClient:
     # ----------------------------
     def recv_loop(self):
         while self.running:
-            msg = recv_line(self.sock)
+            msg = recv_line(self.reader)
             if msg is None:
                 print("[client] disconnected from server")
                 self.status_var.set("Disconnected")
@@ -1,23 +1,14 @@
 #!/usr/bin/env python3
 import socket, json, argparse, threading, sys
+from protocol import LineReader, recv_line
 # version 1.1
 def send_line(s, obj):
     s.sendall((json.dumps(obj)+"\n").encode('utf-8'))
 
-def recv_line(s):
-    buf = b""
-    while True:
-        ch = s.recv(1)
-        if not ch:
-            return None
-        if ch == b"\n":
-            break
-        buf += ch
-    return json.loads(buf.decode('utf-8'))
-
 def listen_loop(s):
+    reader = LineReader(s)
     while True:
-        msg = recv_line(s)
+        msg = recv_line(reader)
         if msg is None:
             print("[client] disconnected from server")
             break
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import socket, threading, json, argparse, random, time
+from protocol import LineReader, recv_line
 
 # 簡單回合制多人遊戲 server
 # Protocol: JSON lines with {"type": "...", "data": ...}
@@ -8,18 +9,6 @@ def send_line(conn, obj):
     msg = json.dumps(obj) + "\n"
     conn.sendall(msg.encode('utf-8'))
 
-def recv_line(conn):
-    # read until newline
-    buf = b""
-    while True:
-        ch = conn.recv(1)
-        if not ch:
-            return None
-        if ch == b"\n":
-            break
-        buf += ch
-    return json.loads(buf.decode('utf-8'))
-
 class GameServer:
     def __init__(self, host='0.0.0.0', port=9000, max_players=2, rounds=3):
         self.host = host
@@ -28,6 +17,7 @@ class GameServer:
         self.rounds = rounds
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.clients = []  # list of (conn, addr, username)
+        self.readers = {}  # conn -> LineReader
         self.lock = threading.Lock()
         self.scores = {}  # username -> score
         self.running = True
@@ -40,7 +30,7 @@ class GameServer:
         accept_thread.start()
         # wait until enough players or timeout
         t0 = time.time()
-        while len(self.clients) < self.max_players and time.time() - t0 < 30:
+        while self.running and len(self.clients) < self.max_players and time.time() - t0 < 30:
             time.sleep(0.5)
         if len(self.clients) < 1:
             print("No players connected; shutting down.")
@@ -55,14 +45,16 @@ class GameServer:
         while self.running and len(self.clients) < self.max_players:
             try:
                 conn, addr = self.server.accept()
+                reader = LineReader(conn)
                 # first message should be {"type":"join","data":{"username":"..."}} 
-                join = recv_line(conn)
+                join = recv_line(reader)
                 if join is None or join.get("type") != "join":
                     conn.close()
                     continue
                 username = join["data"].get("username", str(addr))
                 with self.lock:
                     self.clients.append((conn, addr, username))
+                    self.readers[conn] = reader
                     self.scores[username] = 0
                 print(f"[GameServer] {username} joined from {addr}")
                 send_line(conn, {"type":"joined","data":{"msg":"welcome"}})
@@ -80,6 +72,8 @@ class GameServer:
 
     def play_game(self):
         for r in range(1, self.rounds+1):
+            if not self.running:
+                break
             target = random.randint(1, 10)
             self.broadcast({"type":"round_start", "data":{"round": r}})
             # collect moves in order of client list
@@ -87,7 +81,7 @@ class GameServer:
             for (conn, addr, username) in list(self.clients):
                 try:
                     send_line(conn, {"type":"prompt", "data":{"msg":f"Round {r}: enter 1-10"}})
-                    msg = recv_line(conn)
+                    msg = recv_line(self.readers[conn])
                     if msg is None:
                         val = None
                     else:
@@ -116,6 +110,17 @@ class GameServer:
         self.broadcast({"type":"game_end","data":{"scores":self.scores,"winners":winners}})
         print("Game finished. scores:", self.scores)
 
+    def stop(self):
+        """由 game host 從其他 thread 呼叫（房間被刪除或超過時間上限）：關閉 socket 讓阻塞中的 accept / recv 立即返回"""
+        self.running = False
+        with self.lock:
+            socks = [self.server] + [conn for (conn,_,_) in self.clients]
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
     def shutdown(self):
         self.running = False
         try:
@@ -0,0 +1,92 @@
+import asyncio, json
+
+# asyncio 版遊戲 server 共用的小工具：JSON line 讀取、每個 client 一個有上限的送出佇列、固定頻率的 tick
+# 所有連線與 tick 都在同一個 event loop 上執行，不需要 thread 與 lock
+
+OUTBOX_SIZE = 8  # 每個 client 最多累積幾個未送出的 frame
+
+
+async def recv_json(reader):
+    """從 asyncio StreamReader 讀取一則 JSON 訊息；連線關閉、錯誤或內容無法解析時回傳 None"""
+    try:
+        line = await reader.readline()
+    except (OSError, ValueError):
+        return None
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def encode_line(obj):
+    return (json.dumps(obj, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+class Outbox:
+    """每個 client 一個有上限的送出佇列與 writer task；呼叫端只需把編碼好的 bytes 丟進來"""
+    def __init__(self, writer, maxsize=OUTBOX_SIZE):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize)
+        self.task = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def put(self, data):
+        """client 來不及收（佇列已滿）時丟棄這個 frame 並回傳 False"""
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def encode(self, obj):
+        return encode_line(obj)
+
+    def send(self, obj):
+        return self.put(self.encode(obj))
+
+    def close(self, last=None):
+        """送完佇列中剩下的資料後關閉連線；last 為關閉前最後一則訊息（如死亡通知）
+        佇列滿時先丟掉最舊的 frame 騰出位置，last 一定會送出"""
+        frames = [self.encode(last)] if last is not None else []
+        for data in frames + [None]:
+            while True:
+                try:
+                    self.queue.put_nowait(data)
+                    break
+                except asyncio.QueueFull:
+                    try: self.queue.get_nowait()
+                    except asyncio.QueueEmpty: pass
+
+    def abort(self):
+        """立即中斷連線，不等佇列送完（遊戲被 game host 強制結束時用）"""
+        self.task.cancel()
+        self.writer.transport.abort()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                if data is None:
+                    break
+                self.writer.write(data)
+                await self.writer.drain()
+        except OSError:
+            pass
+        finally:
+            self.writer.close()
+
+
+async def tick_loop(interval, step, is_running):
+    """固定頻率呼叫 step()；以目標時間排程，step 的執行時間不會累積成延遲"""
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while is_running():
+        step()
+        next_tick += interval
+        delay = next_tick - loop.time()
+        if delay < 0:
+            # 落後時重新對齊，不連續補跑
+            next_tick = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
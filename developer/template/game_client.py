@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import socket, json, argparse
+from protocol import LineReader, recv_line
+
+def send_line(s, obj):
+    s.sendall((json.dumps(obj)+"\n").encode('utf-8'))
+
+def listen_loop(s):
+    reader = LineReader(s)
+    while True:
+        msg = recv_line(reader)
+        if msg is None:
+            print("[client] disconnected from server")
+            break
+        # TODO: 處理 server 訊息
+        print("msg:", msg)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--username", type=str, default="p1")
+    args = parser.parse_args()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((args.host, args.port))
+    send_line(s, {"type":"join","data":{"username": args.username}})
+    listen_loop(s)
+    s.close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import asyncio, argparse
+from aio import Outbox, recv_json
+
+# 遊戲 server 範本（asyncio：所有連線都跑在同一個 event loop 上）
+# Protocol: JSON lines with {"type": "...", "data": ...}
+
+class GameServer:
+    def __init__(self, host='0.0.0.0', port=9000, max_players=2):
+        self.host = host
+        self.port = port
+        self.max_players = max_players
+        self.clients = {}  # username -> Outbox
+        self.running = True
+        self.loop = None
+
+    def stop(self):
+        """由 game host 從其他 thread 呼叫（房間被刪除或超過時間上限）：結束遊戲並中斷所有連線"""
+        self.running = False
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._abort_clients)
+            except RuntimeError:
+                pass  # event loop 已結束
+
+    def _abort_clients(self):
+        for outbox in list(self.clients.values()):
+            outbox.abort()
+
+    def start(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"[GameServer] Listening on {self.host}:{self.port}")
+        async with server:
+            while self.running:
+                # TODO: 固定頻率的遊戲可改用 aio.tick_loop
+                await asyncio.sleep(1)
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        join = await recv_json(reader)
+        if join is None or join.get("type") != "join" or len(self.clients) >= self.max_players:
+            writer.close()
+            return
+        username = join["data"].get("username", str(addr))
+        outbox = Outbox(writer)
+        self.clients[username] = outbox
+        outbox.send({"type":"joined","data":{"msg":"welcome"}})
+
+        while self.running:
+            msg = await recv_json(reader)
+            if msg is None:
+                break
+            # TODO: 處理遊戲訊息
+
+        self.clients.pop(username, None)
+        outbox.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--max_players", type=int, default=2)
+    args = parser.parse_args()
+    GameServer(host=args.host, port=args.port, max_players=args.max_players).start()
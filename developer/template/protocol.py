@@ -0,0 +1,54 @@
+import json
+
+# 以換行分隔的 JSON 訊息框架（所有遊戲共用）
+# 一次 recv_into 讀入大量資料，依 "\n" 切出完整訊息，剩餘的留給下一個 frame
+
+RECV_SIZE = 65536
+
+
+class LineReader:
+    def __init__(self, sock, bufsize=RECV_SIZE):
+        self.sock = sock
+        self._chunk = bytearray(bufsize)      # 重複使用的接收緩衝
+        self._view = memoryview(self._chunk)
+        self._buf = bytearray()               # 尚未切出的資料
+        self._scanned = 0                     # _buf 中已確認沒有 "\n" 的長度
+
+    def readline(self):
+        """回傳一行（不含 "\n"）；連線關閉時回傳 None。socket 錯誤 / timeout 會直接拋出"""
+        while True:
+            idx = self._buf.find(b"\n", self._scanned)
+            if idx >= 0:
+                line = bytes(self._buf[:idx])
+                del self._buf[:idx + 1]
+                self._scanned = 0
+                return line
+            self._scanned = len(self._buf)
+
+            n = self.sock.recv_into(self._chunk)
+            if n == 0:
+                return None
+            self._buf += self._view[:n]
+
+    def readexactly(self, n):
+        """讀取剛好 n bytes（與 readline 共用緩衝，可在同一條連線上切換成長度前綴的 frame）；連線關閉時回傳 None"""
+        while len(self._buf) < n:
+            got = self.sock.recv_into(self._chunk)
+            if got == 0:
+                return None
+            self._buf += self._view[:got]
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        self._scanned = 0
+        return data
+
+
+def recv_line(reader):
+    """讀取一則 JSON 訊息；連線關閉或內容無法解析時回傳 None"""
+    line = reader.readline()
+    if line is None:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
@@ -1,8 +1,51 @@
 import requests, os, zipfile, subprocess
-import sys
+import sys, io, json, shutil, hashlib, time, threading, tempfile
 
 SERVER_URL = "http://140.113.17.11:6000"
 DOWNLOAD_ROOT = "downloads"  # 所有玩家下載存放根目錄
+ROOM_PAGE_SIZE = 10         # 房間列表每頁筆數
+DELTA_FILE = "__delta__.json"  # 差異封包內描述變動的檔案
+DOWNLOAD_CHUNK = 1 << 20       # 下載時每次寫入的大小
+DOWNLOAD_RETRIES = 5           # 下載中斷後續傳的次數上限
+DOWNLOAD_RETRY_DELAY = 2       # 續傳前等待的秒數
+DOWNLOAD_TIMEOUT = 30          # 連線 / 讀取逾時（秒）
+ENV_ROOT = os.path.join(DOWNLOAD_ROOT, ".envs")  # 依 requirements.txt 內容 hash 共用的 virtualenv
+STORE_ROOT = os.path.join(DOWNLOAD_ROOT, ".store")  # 所有帳號共用、以檔案 hash 存放的遊戲檔案
+KEEP_VERSIONS = 2              # 每個帳號每款遊戲保留的版本數，較舊的在下載新版本後清掉
+PREFETCH_RATE = 512 * 1024     # 背景預先下載的限速（bytes/s）
+PREFETCH_INTERVAL = 60         # 背景比對新版本的間隔（秒）
+EVENT_POLL_TIMEOUT = 25        # 每次 long-poll 房間事件時讓 server 等待的秒數
+ROOM_START_WAIT = 300          # 加入房間後最多等房主啟動遊戲伺服器的秒數
+
+prefetcher = None              # 登入後啟動的背景預先下載
+
+# 商城資訊的 HTTP 快取：url -> (ETag, JSON 內容)；再次查詢時帶 If-None-Match，304 就沿用
+http_cache = {}
+
+
+# ------------------------------
+# HTTP 快取
+# ------------------------------
+
+def cached_get_json(path):
+    """GET 並以 ETag 重新驗證；回傳 (status_code, JSON)，304 時回傳快取內容"""
+    url = f"{SERVER_URL}{path}"
+    cached = http_cache.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    r = requests.get(url, headers=headers)
+    if r.status_code == 304 and cached:
+        return 200, cached[1]
+    if r.status_code != 200:
+        return r.status_code, None
+    data = r.json()
+    if r.headers.get("ETag"):
+        http_cache[url] = (r.headers["ETag"], data)
+    return 200, data
+
+
+def get_game_meta(game_name):
+    status, meta = cached_get_json(f"/store/game/{game_name}")
+    return meta if status == 200 else None
 
 
 # ------------------------------
@@ -120,12 +163,12 @@ def leave_room(username):
 # ------------------------------
 
 def list_store_games():
-    r = requests.get(f"{SERVER_URL}/store/games")
-    if r.status_code != 200:
+    status, data = cached_get_json("/store/games")
+    if status != 200:
         print("無法取得遊戲列表")
         return []
 
-    games = r.json().get("games", [])
+    games = data.get("games", [])
     if not games:
         print("目前沒有可下載的遊戲")
         return []
@@ -137,12 +180,11 @@ def list_store_games():
     return games
 
 def get_game_details(game_name):
-    r = requests.get(f"{SERVER_URL}/store/game/{game_name}")
-    if r.status_code != 200:
+    meta = get_game_meta(game_name)
+    if meta is None:
         print("找不到這款遊戲")
         return None
 
-    meta = r.json()
     print("\n=== 遊戲資訊 ===")
     print(f"名稱: {meta['game_name']}")
     print(f"作者: {meta['developer']}")
@@ -166,40 +208,549 @@ def choose_and_view_game():
 # 下載遊戲
 # ------------------------------
 
-def download_game(username, game_name, latest_version):
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def find_installed_version(username, game_name, exclude):
+    """找出本地已安裝的其他版本（最近安裝的優先），沒有則回傳 None"""
+    game_root = os.path.join(DOWNLOAD_ROOT, username, game_name)
+    if not os.path.isdir(game_root):
+        return None
+    versions = [v for v in os.listdir(game_root)
+                if v != exclude and not v.endswith((".tmp", ".part")) and os.path.isdir(os.path.join(game_root, v))]
+    if not versions:
+        return None
+    return max(versions, key=lambda v: os.path.getmtime(os.path.join(game_root, v)))
+
+def download_delta(username, game_name, latest_version, base_version, say=print):
+    """以本地的舊版本加上差異封包組出新版本；任何一步失敗都回傳 False，改為完整下載"""
+    game_root = os.path.join(DOWNLOAD_ROOT, username, game_name)
+    base_dir = os.path.join(game_root, base_version)
+    versioned_dir = os.path.join(game_root, latest_version)
+
+    r = requests.post(f"{SERVER_URL}/player/download_delta/{game_name}", json={
+        "username": username,
+        "from_version": base_version,
+        "to_version": latest_version
+    })
+    if r.status_code != 200:
+        return False
+
+    # 先在暫存資料夾組裝，驗證通過才改名成正式的版本資料夾
+    tmp_dir = versioned_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.copytree(base_dir, tmp_dir, ignore=shutil.ignore_patterns("*.zip", ".etag", "__pycache__"))
+    try:
+        with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+            info = json.loads(zf.read(DELTA_FILE))
+            # 不支援 to_version 的 server 一律更新到最新版本，不是要的版本就改為完整下載
+            if info["to"] != latest_version:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return False
+            for path in info["deleted"]:
+                target = os.path.join(tmp_dir, path)
+                if os.path.exists(target):
+                    os.remove(target)
+            for name in zf.namelist():
+                if name != DELTA_FILE:
+                    zf.extract(name, tmp_dir)
+
+        # 本地舊版本可能被改過，逐一比對新版本的檔案 hash
+        for f in info["files"]:
+            path = os.path.join(tmp_dir, f["path"])
+            if not os.path.exists(path) or file_sha256(path) != f["sha256"]:
+                say("差異更新驗證失敗，改為完整下載")
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return False
+    except (zipfile.BadZipFile, KeyError, ValueError, OSError):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+
+    files = add_to_store(game_name, latest_version, tmp_dir, r.headers.get("ETag"))
+    if not verify_files(game_name, latest_version, files):
+        say("差異更新後的檔案與 server 記錄不符，改為完整下載")
+        os.remove(version_record_path(game_name, latest_version))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    if r.headers.get("ETag"):
+        with open(os.path.join(tmp_dir, ".etag"), "w") as f:
+            f.write(r.headers["ETag"])
+    os.replace(tmp_dir, versioned_dir)
+    say(f"差異更新完成（{base_version} → {latest_version}，下載 {len(r.content)} bytes）：{versioned_dir}")
+    prepare_env_async(versioned_dir)
+    return True
+
+def fetch_archive(username, game_name, version, zip_path, etag=None, say=print, rate_limit=None):
+    """下載完整封包到 zip_path：先寫入 .part，中斷後以 Range 從已下載的位置續傳，完成後比對 SHA-256
+    rate_limit 為回傳目前限速（bytes/s，None 表示不限速）的函式
+    回傳 (狀態, ETag)，狀態為 "ok" / "not_modified" / 錯誤訊息"""
+    part_path = zip_path + ".part"
+    part_info_path = part_path + ".json"  # 部分檔案對應的 ETag 與 hash，續傳時用 If-Range 確認檔案沒換過
+    url = f"{SERVER_URL}/player/download/{game_name}"
+
+    part_info = None
+    if os.path.exists(part_path) and os.path.exists(part_info_path):
+        with open(part_info_path, "r") as f:
+            part_info = json.load(f)
+
+    for attempt in range(DOWNLOAD_RETRIES):
+        have = os.path.getsize(part_path) if part_info and os.path.exists(part_path) else 0
+        headers = {}
+        if have:
+            headers["Range"] = f"bytes={have}-"
+            headers["If-Range"] = part_info["etag"]
+        elif etag:
+            headers["If-None-Match"] = etag
+
+        try:
+            r = requests.get(url, params={"username": username, "version": version}, headers=headers,
+                             stream=True, timeout=DOWNLOAD_TIMEOUT)
+            if r.status_code == 304:
+                return "not_modified", etag
+            if r.status_code == 416:
+                # 已下載的部分與 server 上的檔案對不上，重新開始
+                part_info = None
+                continue
+            if r.status_code not in (200, 206):
+                return r.text, None
+
+            if r.status_code == 200:
+                # server 送回完整檔案（第一次下載，或檔案已更新導致 If-Range 不成立）
+                part_info = {"etag": r.headers.get("ETag", ""), "sha256": r.headers.get("X-Content-SHA256")}
+                with open(part_info_path, "w") as f:
+                    json.dump(part_info, f)
+                mode = "wb"
+            else:
+                mode = "ab"
+                say(f"從 {have} bytes 處續傳...")
+
+            with open(part_path, mode) as f:
+                start, written = time.time(), 0
+                limit = rate_limit() if rate_limit else None
+                for chunk in r.iter_content(min(DOWNLOAD_CHUNK, limit) if limit else DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    written += len(chunk)
+                    limit = rate_limit() if rate_limit else None
+                    if limit:
+                        # 平均速度超過限制時暫停，直到回到限速以內
+                        delay = start + written / limit - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+        except requests.RequestException as e:
+            say(f"下載中斷（{e}），{DOWNLOAD_RETRY_DELAY} 秒後續傳...")
+            time.sleep(DOWNLOAD_RETRY_DELAY)
+            continue
+
+        # 解壓前先驗證 checksum，不符就整個重下
+        expected = part_info.get("sha256")
+        if expected and file_sha256(part_path) != expected:
+            say("檔案驗證失敗，重新下載...")
+            part_info = None
+            continue
+
+        os.replace(part_path, zip_path)
+        os.remove(part_info_path)
+        return "ok", part_info["etag"]
+
+    return "重試次數已用完", None
+
+download_locks = {}             # 版本資料夾 -> Lock，前景與背景不會同時下載同一個版本
+download_locks_guard = threading.Lock()
+
+def download_game(username, game_name, latest_version, quiet=False, rate_limit=None):
+    """下載（或更新）遊戲版本；quiet 時不輸出訊息（背景預先下載用）"""
+    say = (lambda *args: None) if quiet else print
 
     # 設置玩家的下載路徑
     versioned_dir = os.path.join(DOWNLOAD_ROOT, username, game_name, latest_version)
-    os.makedirs(versioned_dir, exist_ok=True)
 
-    zip_path = os.path.join(versioned_dir, f"{game_name}.zip")
+    with download_locks_guard:
+        lock = download_locks.setdefault(versioned_dir, threading.Lock())
+    if not lock.acquire(blocking=False):
+        # 背景正在下載同一個版本：解除它的限速並等它完成
+        say("背景正在下載這個版本，等待完成...")
+        if prefetcher:
+            prefetcher.urgent.set()
+        lock.acquire()
+    try:
+        ok = _download_game(username, game_name, latest_version, versioned_dir, say, rate_limit)
+    finally:
+        lock.release()
+    if ok:
+        gc_downloads(username, game_name)
+    return ok
+
+def _download_game(username, game_name, latest_version, versioned_dir, say, rate_limit):
+    # 其他帳號已下載過同一版本：直接從共用快取建立（之後的 ETag 驗證通常會得到 304）
+    if not os.path.isdir(versioned_dir) and link_from_store(game_name, latest_version, versioned_dir):
+        say("已從本機共用快取取得遊戲檔案")
+
+    # 已有其他版本時先嘗試只下載變動的檔案
+    if not os.path.isdir(versioned_dir):
+        base_version = find_installed_version(username, game_name, latest_version)
+        if base_version and download_delta(username, game_name, latest_version, base_version, say):
+            return True
+
+    # 下載中的檔案放在 <版本>.part，解壓完成後才出現正式的版本資料夾，
+    # 其他流程看到版本資料夾存在就代表可以直接使用
+    staging_dir = versioned_dir + ".part"
+    os.makedirs(staging_dir, exist_ok=True)
+    zip_path = os.path.join(staging_dir, f"{game_name}.zip")
+    etag_path = os.path.join(versioned_dir, ".etag")
+
+    # 已下載過時帶上當時的 ETag，server 回 304 表示本地已是同一份檔案
+    etag = None
+    if os.path.exists(etag_path):
+        with open(etag_path, "r") as f:
+            etag = f.read().strip()
+
+    say("開始下載遊戲...")
+    status, etag = fetch_archive(username, game_name, latest_version, zip_path, etag, say, rate_limit)
+    if status == "not_modified":
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        say(f"已是最新版本：{versioned_dir}")
+        prepare_env_async(versioned_dir)
+        return True
+    if status != "ok":
+        say("下載失敗:", status)
+        return False
+
+    # 解壓到暫存資料夾再改名
+    tmp_dir = versioned_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(tmp_dir)
+
+    # 解壓後的檔案與 server 的檔案清單比對，通過才收進共用快取並刪掉 zip
+    files = add_to_store(game_name, latest_version, tmp_dir, etag)
+    if not verify_files(game_name, latest_version, files):
+        say("解壓後的檔案與 server 記錄不符，請重新下載")
+        os.remove(version_record_path(game_name, latest_version))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return False
+    if etag:
+        with open(os.path.join(tmp_dir, ".etag"), "w") as f:
+            f.write(etag)
+    shutil.rmtree(versioned_dir, ignore_errors=True)
+    os.replace(tmp_dir, versioned_dir)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    say(f"下載完成：{versioned_dir}")
+    prepare_env_async(versioned_dir)
+    return True
+
+# ------------------------------
+# 共用下載快取
+#   同一台電腦上的所有帳號共用 STORE_ROOT：
+#     objects/<hash 前兩碼>/<sha256>  每種檔案內容只存一份
+#     versions/<遊戲>/<版本>.json     版本的檔案清單與 ETag
+#   各帳號的 downloads/<帳號>/<遊戲>/<版本> 內的檔案都是指向 objects 的 hardlink；
+#   下載流程只會寫入新建立的檔案，不會改寫已連結的檔案
+#   object 的 link 數只剩 1（沒有任何帳號使用）時由 gc_downloads 刪除
+# ------------------------------
 
-    print("開始下載遊戲...")
+def object_path(sha256):
+    return os.path.join(STORE_ROOT, "objects", sha256[:2], sha256)
 
-    r = requests.post(
-        f"{SERVER_URL}/player/download/{game_name}",
-        json={"username": username},
-        stream=True
-    )
+def version_record_path(game_name, version):
+    return os.path.join(STORE_ROOT, "versions", game_name, f"{version}.json")
 
-    if r.status_code != 200:
-        print("下載失敗:", r.text)
+def link_or_copy(src, dst):
+    # hardlink 本身是原子的；已存在代表其他 player process 剛收進相同內容，不能覆寫（可能連結著別的帳號的下載）
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        return
+    except OSError:
+        pass
+    # 不支援 hardlink 時複製到各自的暫存檔再 rename，不會寫入既有檔案的 inode
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, open(src, "rb") as fp:
+            shutil.copyfileobj(fp, f)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def add_to_store(game_name, version, src_dir, etag):
+    """把組好的版本收進共用快取：src_dir 內的檔案改為指向 objects 的 hardlink，回傳檔案清單"""
+    files = []
+    for root, dirs, names in os.walk(src_dir):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, src_dir).replace(os.sep, "/")
+            if rel == ".etag":
+                continue
+            sha256 = file_sha256(path)
+            obj = object_path(sha256)
+            if os.path.exists(obj):
+                # 已有相同內容：改成連結到既有的那一份
+                os.remove(path)
+                link_or_copy(obj, path)
+            else:
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                link_or_copy(path, obj)
+            files.append({"path": rel, "sha256": sha256})
+
+    record_path = version_record_path(game_name, version)
+    os.makedirs(os.path.dirname(record_path), exist_ok=True)
+    # 共用快取可能有其他 player process 同時寫入同一個版本，各自使用不重複的暫存檔
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(record_path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"etag": etag, "files": files}, f)
+    os.replace(tmp_path, record_path)
+    return files
+
+def link_from_store(game_name, version, dest_dir):
+    """共用快取中有完整的這個版本時，以 hardlink 建立 dest_dir"""
+    try:
+        with open(version_record_path(game_name, version), "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
         return False
 
-    # 寫入 zip
-    with open(zip_path, "wb") as f:
-        for chunk in r.iter_content(1024):
-            f.write(chunk)
+    tmp_dir = dest_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        for f in record["files"]:
+            target = os.path.join(tmp_dir, *f["path"].split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            link_or_copy(object_path(f["sha256"]), target)
+        if record.get("etag"):
+            with open(os.path.join(tmp_dir, ".etag"), "w") as fp:
+                fp.write(record["etag"])
+        os.replace(tmp_dir, dest_dir)
+        return True
+    except OSError:
+        # object 已被清掉，改為正常下載
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
 
-    # 解壓
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(versioned_dir)
+def verify_files(game_name, version, files):
+    """與 server 提供的檔案清單比對；取不到清單時以已驗證過的 zip checksum 為準"""
+    status, manifest = cached_get_json(f"/store/game/{game_name}/manifest/{version}")
+    if status != 200:
+        return True
+    expected = {f["path"]: f["sha256"] for f in manifest.get("files", [])}
+    return expected == {f["path"]: f["sha256"] for f in files}
+
+def gc_downloads(username, game_name):
+    """每款遊戲只保留最近的 KEEP_VERSIONS 個版本，再清掉沒有任何帳號使用的共用檔案"""
+    game_root = os.path.join(DOWNLOAD_ROOT, username, game_name)
+    versions = [v for v in os.listdir(game_root)
+                if not v.endswith((".tmp", ".part")) and os.path.isdir(os.path.join(game_root, v))]
+    versions.sort(key=lambda v: os.path.getmtime(os.path.join(game_root, v)), reverse=True)
+    for version in versions[KEEP_VERSIONS:]:
+        shutil.rmtree(os.path.join(game_root, version), ignore_errors=True)
+
+    objects_root = os.path.join(STORE_ROOT, "objects")
+    if not os.path.isdir(objects_root):
+        return
+    removed = False
+    for root, _, names in os.walk(objects_root):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed = True
+            except OSError:
+                pass
+    if not removed:
+        return
 
-    print(f"下載完成：{versioned_dir}")
-    return True
+    # 有 object 被清掉的版本紀錄已不完整，一併刪除
+    versions_root = os.path.join(STORE_ROOT, "versions")
+    for root, _, names in os.walk(versions_root):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+                if not all(os.path.exists(object_path(f["sha256"])) for f in record["files"]):
+                    os.remove(path)
+            except (OSError, ValueError, KeyError):
+                pass
+
+# ------------------------------
+# 背景預先下載
+#   登入後定期比對：本地已有的遊戲是否有新版本、目前開放的房間使用的版本是否已下載，
+#   有缺的就在背景限速下載，加入房間時通常不必再等下載
+# ------------------------------
 
+class Prefetcher:
+    def __init__(self, username, rate=PREFETCH_RATE, interval=PREFETCH_INTERVAL):
+        self.username = username
+        self.rate = rate
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.urgent = threading.Event()  # 前景正在等背景的下載，暫時不限速
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def rate_limit(self):
+        return None if self.urgent.is_set() else self.rate
+
+    def wanted(self):
+        """需要預先下載的 (遊戲, 版本)；下載端點只提供最新版本，所以只取最新版本"""
+        status, data = cached_get_json("/store/games")
+        if status != 200:
+            return []
+        latest = {g["game_name"]: g["latest_version"] for g in data.get("games", [])}
+
+        wanted = []
+        user_root = os.path.join(DOWNLOAD_ROOT, self.username)
+        if os.path.isdir(user_root):
+            wanted += [(game, latest[game]) for game in sorted(os.listdir(user_root)) if game in latest]
+
+        r = requests.get(f"{SERVER_URL}/lobby/list_rooms",
+                         params={"status": "waiting,running", "has_slot": "1", "limit": 100})
+        if r.status_code == 200:
+            for room in r.json().get("rooms", []):
+                if latest.get(room["game_name"]) == room["version"]:
+                    wanted.append((room["game_name"], room["version"]))
+        return list(dict.fromkeys(wanted))
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                for game_name, version in self.wanted():
+                    if self.stop_event.is_set():
+                        break
+                    if os.path.isdir(os.path.join(DOWNLOAD_ROOT, self.username, game_name, version)):
+                        continue
+                    download_game(self.username, game_name, version, quiet=True, rate_limit=self.rate_limit)
+                    self.urgent.clear()
+            except (requests.RequestException, OSError, ValueError, zipfile.BadZipFile):
+                pass
+            self.stop_event.wait(self.interval)
 
 
+
+# ------------------------------
+# 遊戲執行環境快取
+#   每種 requirements.txt 內容只建一次 virtualenv（ENV_ROOT/<hash>），不同版本 / 遊戲相同需求時共用；
+#   下載完成後在背景建立，開始遊戲時環境已就緒就不必再跑 pip
+# ------------------------------
+
+env_locks = {}                  # requirements hash -> Lock，同一個環境只會有一個 thread 在建立
+env_locks_guard = threading.Lock()
+ENV_LOCK_STALE = 30 * 60        # 建立環境的鎖檔超過這個時間（秒）還在，視為建立中的 process 已中斷
+
+def acquire_file_lock(path, stale=ENV_LOCK_STALE):
+    """以 O_CREAT|O_EXCL 建立鎖檔（Windows 也適用），讓同一台電腦上的多個 player process 互斥；已被持有時等待"""
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue  # 鎖檔剛好被釋放
+            time.sleep(0.5)
+            continue
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return
+
+def release_file_lock(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def requirements_key(game_dir):
+    """requirements.txt 去掉註解與空行、排序後的 hash；沒有任何需求時回傳 None"""
+    path = os.path.join(game_dir, "requirements.txt")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        lines = sorted({line.split("#", 1)[0].strip() for line in f} - {""})
+    if not lines:
+        return None
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()[:16]
+
+def env_python(env_dir):
+    if os.name == "nt":
+        return os.path.join(env_dir, "Scripts", "python.exe")
+    return os.path.join(env_dir, "bin", "python")
+
+def ensure_env(game_dir):
+    """回傳執行這個遊戲要用的 Python；環境尚未建立時建立（背景正在建立時等它完成），失敗回傳 None"""
+    key = requirements_key(game_dir)
+    if key is None:
+        return sys.executable
+
+    env_dir = os.path.abspath(os.path.join(ENV_ROOT, key))
+    ready_path = os.path.join(env_dir, ".ready")
+    with env_locks_guard:
+        lock = env_locks.setdefault(key, threading.Lock())
+    with lock:
+        if os.path.exists(ready_path):
+            return env_python(env_dir)
+
+        # ENV_ROOT 是所有帳號共用的，其他 player process 可能正在建立同一個環境
+        os.makedirs(ENV_ROOT, exist_ok=True)
+        lock_path = env_dir + ".lock"
+        acquire_file_lock(lock_path)
+        try:
+            return _build_env(game_dir, key, env_dir, ready_path)
+        finally:
+            release_file_lock(lock_path)
+
+def _build_env(game_dir, key, env_dir, ready_path):
+    """持有鎖檔時呼叫：等待期間其他 process 可能已建好"""
+    if os.path.exists(ready_path):
+        return env_python(env_dir)
+
+    # 沿用系統已安裝的套件，需求已滿足時 pip 不必下載
+    shutil.rmtree(env_dir, ignore_errors=True)
+    with open(env_dir + ".log", "w", encoding="utf-8") as log:
+        ok = subprocess.call([sys.executable, "-m", "venv", "--system-site-packages", env_dir],
+                             stdout=log, stderr=log) == 0
+        ok = ok and subprocess.call([env_python(env_dir), "-m", "pip", "install", "-r",
+                                     os.path.join(os.path.abspath(game_dir), "requirements.txt")],
+                                    stdout=log, stderr=log) == 0
+    if not ok:
+        shutil.rmtree(env_dir, ignore_errors=True)
+        return None
+    with open(ready_path, "w") as f:
+        f.write(key)
+    return env_python(env_dir)
+
+def prepare_env_async(game_dir):
+    """下載完成後在背景建立執行環境"""
+    threading.Thread(target=ensure_env, args=(game_dir,), daemon=True).start()
+
+def launch_game_client(game_dir, host_addr, host_port, username):
+    python = ensure_env(game_dir)
+    if python is None:
+        print(f"安裝遊戲相依套件失敗，詳見 {ENV_ROOT} 中的 log")
+        return False
+    cmd = [
+    python, os.path.join(game_dir, "game_client.py"),
+    "--host", host_addr,
+    "--port", str(host_port),
+    "--username", username
+    ]
+    print("啟動遊戲客戶端：", " ".join(cmd))
+    subprocess.call(cmd)
+    return True
+
 # ------------------------------
 # 建立或加入房間並執行遊戲
 # ------------------------------
@@ -234,62 +785,106 @@ def create_room_and_play(username, game_name):
 
     print(f"遊戲伺服器已啟動：{host_addr}:{host_port}")
 
-    GAME_CLIENT_PATH = os.path.join(os.getcwd(), DOWNLOAD_ROOT, username, game_name, version, "game_client.py")
+    # 3) 玩家啟動 game_client.py（執行環境通常已在下載後建好）
     game_dir = os.path.join(os.getcwd(), DOWNLOAD_ROOT, username, game_name, version)
-    subprocess.run(
-        [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
-        cwd=game_dir,
-        check=True
-    )
-
-
-    # 3) 玩家啟動 game_client.py
-    cmd = [
-    sys.executable, GAME_CLIENT_PATH,
-    "--host", host_addr,
-    "--port", str(host_port),
-    "--username", username
-    ]
-    print("啟動遊戲客戶端：", " ".join(cmd))
-    subprocess.call(cmd)
+    if not launch_game_client(game_dir, host_addr, host_port, username):
+        leave_room(username)
+        return False
 
     record_play_server(username, game_name, version)
     leave_room(username)
     return True
 
-def list_rooms():
-    """取得目前所有房間並列出"""
-    r = requests.get(f"{SERVER_URL}/lobby/list_rooms")
+def list_rooms(cursor=None):
+    """取得一頁可加入的房間（未滿、等待中或遊戲中）並列出；回傳 (房間列表, 下一頁 cursor)"""
+    params = {"status": "waiting,running", "has_slot": "1", "limit": ROOM_PAGE_SIZE}
+    if cursor:
+        params["cursor"] = cursor
+    r = requests.get(f"{SERVER_URL}/lobby/list_rooms", params=params)
     if r.status_code != 200:
         print("無法取得房間列表")
-        return [], []
+        return [], None
 
     rooms = r.json().get("rooms", [])
     if not rooms:
         print("目前沒有任何房間")
-        return [], []
-    # print(rooms)
-    room_ids=[]
+        return [], None
     print("\n=== 房間列表 ===")
-    for idx, room_id in enumerate(rooms):
-        print(f"[{idx+1}] {rooms[room_id]['game_name']} (版本 {rooms[room_id]['version']}), "
-              f"人數 {len(rooms[room_id]['players'])}/{rooms[room_id]['max_players']}, 狀態: {rooms[room_id]['status']}")
-        room_ids.append(room_id)
+    for idx, room in enumerate(rooms):
+        print(f"[{idx+1}] {room['game_name']} (版本 {room['version']}), "
+              f"人數 {room['player_count']}/{room['max_players']}, 狀態: {room['status']}")
     print("================\n")
-    return rooms, room_ids
+    return rooms, r.json().get("next_cursor")
+
+def wait_room_started(username, room_id, since):
+    """以 long-poll 等待房主啟動遊戲伺服器；回傳 (host_addr, host_port)，房間解散或逾時回傳 None"""
+    print("等待房主啟動遊戲伺服器...（Ctrl+C 取消）")
+    deadline = time.monotonic() + ROOM_START_WAIT
+    try:
+        while time.monotonic() < deadline:
+            try:
+                r = requests.get(f"{SERVER_URL}/lobby/room_events",
+                                 params={"since": since, "room_id": room_id, "timeout": EVENT_POLL_TIMEOUT},
+                                 timeout=EVENT_POLL_TIMEOUT + 10)
+                res = r.json()
+            except (requests.RequestException, ValueError):
+                time.sleep(DOWNLOAD_RETRY_DELAY)
+                continue
+            if not res.get("success"):
+                return None
+
+            if res.get("reset"):
+                # 事件已被丟棄，重新取得房間目前狀態（已在房內時 join_room 只會回傳房間資料）
+                r = requests.post(f"{SERVER_URL}/lobby/join_room", json={"username": username, "room_id": room_id})
+                if not r.json().get("success"):
+                    print("房間已解散")
+                    return None
+                room = r.json()["room"]
+                if room["host_addr"] is not None:
+                    return room["host_addr"], room["host_port"]
+                since = r.json()["event_seq"]
+                continue
+
+            since = res["seq"]
+            for event in res["events"]:
+                if event["type"] == "deleted" or event.get("status") == "finished":
+                    print("房間已解散")
+                    return None
+                if event["type"] == "player_joined":
+                    print(f"{event['username']} 加入房間（{len(event['players'])} 人）")
+                elif event["type"] == "player_left":
+                    print(f"{event['username']} 離開房間（{len(event['players'])} 人）")
+                elif event["type"] == "status" and event.get("host_addr"):
+                    return event["host_addr"], event["host_port"]
+    except KeyboardInterrupt:
+        print("已取消等待")
+        return None
+    print("等待逾時，房主尚未啟動遊戲伺服器")
+    return None
 
 def join_room_and_play(username):
     room = None
-    rooms, room_ids = list_rooms()
-    if not rooms:
-        return
-
-    try:
-        choice = int(input("輸入要加入房間的 index: ")) -1
-        room = rooms[room_ids[choice]]
-    except (ValueError, IndexError):
-        print("選擇錯誤")
-        return
+    cursor = None
+    while room is None:
+        rooms, next_cursor = list_rooms(cursor)
+        if not rooms:
+            return
+
+        prompt = "輸入要加入房間的 index"
+        if next_cursor:
+            prompt += "（輸入 n 看下一頁）"
+        choice = input(prompt + ": ").strip()
+        if choice == "n" and next_cursor:
+            cursor = next_cursor
+            continue
+        try:
+            index = int(choice) - 1
+            if index < 0:
+                raise IndexError
+            room = rooms[index]
+        except (ValueError, IndexError):
+            print("選擇錯誤")
+            return
 
     room_id = room["room_id"]
     game_name = room["game_name"]
@@ -324,30 +919,23 @@ def join_room_and_play(username):
         return False
     host_addr = room["host_addr"]
     host_port = room["host_port"]
+    game_dir = os.path.join(os.getcwd(), DOWNLOAD_ROOT, username, game_name, version)
 
     if host_addr is None:
-        print("房主尚未啟動遊戲伺服器，請稍後再試")
-        return False
+        # 房主尚未啟動遊戲伺服器：等待時先在背景準備執行環境
+        prepare_env_async(game_dir)
+        started = wait_room_started(username, room_id, r.json().get("event_seq", 0))
+        if started is None:
+            leave_room(username)
+            return False
+        host_addr, host_port = started
 
     print(f"連線到房主：{host_addr}:{host_port}")
 
-    GAME_CLIENT_PATH = os.path.join(os.getcwd(), DOWNLOAD_ROOT, username, game_name, version, "game_client.py")
-
-    game_dir = os.path.join(os.getcwd(), DOWNLOAD_ROOT, username, game_name, version)
-    subprocess.run(
-        [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
-        cwd=game_dir,
-        check=True
-    )
-
     # 3) 玩家啟動 game_client.py
-    cmd = [
-    sys.executable, GAME_CLIENT_PATH,
-    "--host", host_addr,
-    "--port", str(host_port),
-    "--username", username
-    ]
-    subprocess.call(cmd)
+    if not launch_game_client(game_dir, host_addr, host_port, username):
+        leave_room(username)
+        return False
     record_play_server(username, game_name, version)
     leave_room(username)
     return True
@@ -370,12 +958,11 @@ def run_game(username):
             return False
 
         # 1) 從 server 取得最新版本資訊
-        r = requests.get(f"{SERVER_URL}/store/game/{game_name}")
-        if r.status_code != 200:
+        meta = get_game_meta(game_name)
+        if meta is None:
             print("找不到這款遊戲")
             return False
-        
-        meta = r.json()
+
         latest_version = meta["latest_version"]
 
         # 2) 確認玩家本地是否有這個版本
@@ -406,11 +993,10 @@ def review_game(username):
         return None
 
     # 2. 取得遊戲資料
-    r = requests.get(f"{SERVER_URL}/store/game/{game_name}")
-    if r.status_code != 200:
+    meta = get_game_meta(game_name)
+    if meta is None:
         print("找不到這款遊戲")
         return None
-    meta = r.json()
 
     # 3. 輸入評分與留言
     while True:
@@ -453,6 +1039,8 @@ if __name__ == "__main__":
             password = input("Password: ")
 
             if choice == "1" and login(username, password):
+                prefetcher = Prefetcher(username)
+                prefetcher.start()
                 break
             if choice == "2" and register(username, password):
                 print("註冊成功，請登入")
@@ -483,12 +1071,9 @@ if __name__ == "__main__":
                     game_name = get_game_name()
                     if game_name is None:
                         continue
-                    r = requests.get(f"{SERVER_URL}/store/game/{game_name}")
-                    if r.status_code != 200:
-                        print("找不到這款遊戲")
-                        continue
-                    meta = r.json()
+                    meta = get_game_meta(game_name)
                     if not meta:
+                        print("找不到這款遊戲")
                         continue
                     latest_version = meta["latest_version"]
                     download_game(username, game_name, latest_version)
@@ -501,6 +1086,7 @@ if __name__ == "__main__":
 
             elif op == "0":
                 if logout(username):
+                    prefetcher.stop()
                     print("登出，離開系統")
                     break
                 else:
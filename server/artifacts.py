@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+# ============================================================
+# 下載用的遊戲封包
+#   - 上架 / 更新時就把版本資料夾打包成 zip，以內容的 SHA-256 命名：
+#       uploaded_games/<game>/.dist/<sha256>.zip
+#   - 每個版本一份 manifest：uploaded_games/<game>/.dist/<version>.json
+#     （封包檔名、大小、hash，以及版本內每個檔案的路徑、大小、hash）
+#   - 差異封包：只含兩個版本間新增 / 變動的檔案，快取在 .dist/delta/<舊 hash>_<新 hash>.zip
+#   - zip 內檔案排序、時間戳固定，內容相同的版本會得到同一個檔案
+#   - 先寫暫存檔再 rename，同時有多個請求也不會讀到寫一半的 zip
+# ============================================================
+
+DIST_DIR = ".dist"
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)  # zip 格式能表示的最早時間，讓同內容的封包 hash 相同
+SKIP_DIRS = {"__pycache__", DIST_DIR}
+DELTA_FILE = "__delta__.json"  # 差異封包內描述變動的檔案
+
+
+def dist_dir(upload_dir, game_name):
+    return os.path.join(upload_dir, game_name, DIST_DIR)
+
+
+def manifest_path(upload_dir, game_name, version):
+    return os.path.join(dist_dir(upload_dir, game_name), f"{version}.json")
+
+
+def artifact_path(upload_dir, game_name, manifest):
+    return os.path.join(dist_dir(upload_dir, game_name), manifest["file"])
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def iter_version_files(version_dir):
+    """依路徑排序列出版本資料夾內的檔案：(相對路徑, 絕對路徑)"""
+    files = []
+    for root, dirs, names in os.walk(version_dir):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in names:
+            full = os.path.join(root, name)
+            files.append((os.path.relpath(full, version_dir).replace(os.sep, "/"), full))
+    files.sort()
+    return files
+
+
+def load_manifest(upload_dir, game_name, version):
+    """回傳 manifest；尚未打包或封包遺失時回傳 None"""
+    path = manifest_path(upload_dir, game_name, version)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(artifact_path(upload_dir, game_name, manifest)):
+        return None
+    return manifest
+
+
+def build_artifact(upload_dir, game_name, version):
+    """打包一個版本並寫入 manifest，回傳 manifest"""
+    version_dir = os.path.join(upload_dir, game_name, version)
+    out_dir = dist_dir(upload_dir, game_name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    files = []
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".zip.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+                for rel, full in iter_version_files(version_dir):
+                    with open(full, "rb") as src:
+                        data = src.read()
+                    _write_entry(zf, rel, data)
+                    files.append({"path": rel, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()})
+            f.flush()
+            os.fsync(f.fileno())
+        sha256 = file_sha256(tmp_path)
+        size = os.path.getsize(tmp_path)
+        # 同內容的封包已存在就直接沿用
+        os.replace(tmp_path, os.path.join(out_dir, f"{sha256}.zip"))
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+
+    manifest = {"version": version, "file": f"{sha256}.zip", "sha256": sha256, "size": size, "files": files}
+    # 第一次下載時可能有多個請求同時補建，各自寫自己的暫存檔
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path(upload_dir, game_name, version))
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    return manifest
+
+
+def get_manifest(upload_dir, game_name, version):
+    """讀取 manifest；沒有封包或是舊格式（缺少檔案清單）時補建"""
+    manifest = load_manifest(upload_dir, game_name, version)
+    if manifest is None or "files" not in manifest:
+        manifest = build_artifact(upload_dir, game_name, version)
+    return manifest
+
+
+def build_delta(upload_dir, game_name, old_manifest, new_manifest):
+    """建立（或沿用快取的）差異封包並回傳路徑
+    封包內含新增 / 變動的檔案，以及描述此次差異（含被刪除的檔案與新版本完整檔案清單）的 DELTA_FILE"""
+    old_files = {f["path"]: f["sha256"] for f in old_manifest["files"]}
+    new_files = {f["path"]: f["sha256"] for f in new_manifest["files"]}
+    changed = sorted(p for p, h in new_files.items() if old_files.get(p) != h)
+    deleted = sorted(p for p in old_files if p not in new_files)
+
+    out_dir = os.path.join(dist_dir(upload_dir, game_name), "delta")
+    path = os.path.join(out_dir, f"{old_manifest['sha256']}_{new_manifest['sha256']}.zip")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(out_dir, exist_ok=True)
+    version_dir = os.path.join(upload_dir, game_name, new_manifest["version"])
+    info = {"from": old_manifest["version"], "to": new_manifest["version"],
+            "deleted": deleted, "files": new_manifest["files"], "sha256": new_manifest["sha256"]}
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".zip.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+                _write_entry(zf, DELTA_FILE, json.dumps(info, indent=2).encode("utf-8"))
+                for rel in changed:
+                    with open(os.path.join(version_dir, rel), "rb") as src:
+                        _write_entry(zf, rel, src.read())
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    return path
+
+
+def _write_entry(zf, name, data):
+    info = zipfile.ZipInfo(name, ZIP_DATE)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    zf.writestr(info, data)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import tempfile
+
+from artifacts import get_manifest
+
+# ============================================================
+# 每款遊戲的檔案 blob 庫：uploaded_games/<game>/.blobs/<sha256>
+#   - 上架版本時把該版本的檔案收進 blob 庫（以 hardlink，不佔額外空間）
+#   - 增量更新時 client 先送出檔案清單，只上傳 blob 庫裡沒有的檔案，
+#     server 再從 blob 庫組出新版本的資料夾
+# ============================================================
+
+BLOB_DIR = ".blobs"
+BLOB_BLOCK = 1 << 20
+
+
+def blob_dir(upload_dir, game_name):
+    return os.path.join(upload_dir, game_name, BLOB_DIR)
+
+
+def blob_path(upload_dir, game_name, sha256):
+    return os.path.join(blob_dir(upload_dir, game_name), sha256)
+
+
+def is_sha256(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def safe_relpath(path):
+    """檢查 client 給的檔案路徑，不可為絕對路徑或跳出版本資料夾"""
+    if not isinstance(path, str) or not path or "\\" in path:
+        return None
+    norm = posixpath.normpath(path)
+    if norm.startswith("/") or norm == "." or norm.split("/")[0] == "..":
+        return None
+    return norm
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def add_blob_from_file(upload_dir, game_name, sha256, path):
+    dst = blob_path(upload_dir, game_name, sha256)
+    if os.path.exists(dst):
+        return
+    out_dir = os.path.dirname(dst)
+    os.makedirs(out_dir, exist_ok=True)
+    # hardlink 本身是原子的；已存在代表其他請求剛收進同一個 blob
+    try:
+        os.link(path, dst)
+        return
+    except FileExistsError:
+        return
+    except OSError:
+        pass
+    # 不支援 hardlink 時複製到各自的暫存檔再 rename
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, open(path, "rb") as src:
+            shutil.copyfileobj(src, f, BLOB_BLOCK)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def ingest_version(upload_dir, game_name, version):
+    """把已上架版本的檔案收進 blob 庫"""
+    version_dir = os.path.join(upload_dir, game_name, version)
+    for f in get_manifest(upload_dir, game_name, version)["files"]:
+        if not os.path.exists(blob_path(upload_dir, game_name, f["sha256"])):
+            add_blob_from_file(upload_dir, game_name, f["sha256"], os.path.join(version_dir, f["path"]))
+
+
+def missing_blobs(upload_dir, game_name, hashes):
+    return sorted({h for h in hashes if not os.path.exists(blob_path(upload_dir, game_name, h))})
+
+
+def save_blob(upload_dir, game_name, sha256, stream, max_size):
+    """從請求串流寫入 blob，一邊寫一邊計算 hash；內容與 sha256 不符或超過大小時回傳錯誤訊息"""
+    out_dir = blob_dir(upload_dir, game_name)
+    os.makedirs(out_dir, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: stream.read(BLOB_BLOCK), b""):
+                size += len(chunk)
+                if size > max_size:
+                    return "檔案超過大小上限"
+                h.update(chunk)
+                f.write(chunk)
+        if h.hexdigest() != sha256:
+            return "檔案內容與 hash 不符"
+        os.replace(tmp_path, blob_path(upload_dir, game_name, sha256))
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def materialize(upload_dir, game_name, version, files):
+    """依檔案清單從 blob 庫組出版本資料夾（先組在暫存資料夾，完成後改名）"""
+    version_dir = os.path.join(upload_dir, game_name, version)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.join(upload_dir, game_name), prefix=".build-")
+    try:
+        for f in files:
+            dst = os.path.join(tmp_dir, *f["path"].split("/"))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            _link_or_copy(blob_path(upload_dir, game_name, f["sha256"]), dst)
+        os.rename(tmp_dir, version_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import time
+from threading import RLock
+
+# ============================================================
+# 商城目錄索引
+#   - 所有遊戲的 meta.json 常駐記憶體，/store/games 不必每次掃描資料夾
+#   - developer server 改動遊戲後呼叫 update()，同時遞增 uploaded_games/.catalog_version；
+#     lobby 每次查詢只 stat 這個檔案，版本變了才重新載入
+#   - 列表內容的 hash 作為 ETag，client 帶 If-None-Match 時可回 304
+# ============================================================
+
+VERSION_FILE = ".catalog_version"
+
+
+class Catalog:
+    def __init__(self, upload_dir):
+        self.upload_dir = upload_dir
+        self.version_path = os.path.join(upload_dir, VERSION_FILE)
+        self.lock = RLock()
+        self.games = {}      # game_name -> meta
+        self.stamp = None    # 上次載入時版本檔的 (mtime, 內容)
+        self.list_body = b""
+        self.etag = ""
+        self.last_modified = time.time()
+        self.refresh(force=True)
+
+    # ------------------------------
+    # 載入
+    # ------------------------------
+    def _read_stamp(self):
+        try:
+            mtime = os.stat(self.version_path).st_mtime_ns
+        except OSError:
+            return None
+        with open(self.version_path, "r") as f:
+            return mtime, f.read().strip()
+
+    def _load_meta(self, game_name):
+        meta_path = os.path.join(self.upload_dir, game_name, "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def refresh(self, force=False):
+        """其他 process 改過目錄時（版本檔變了）重新載入全部 meta.json"""
+        stamp = self._read_stamp()
+        if not force and stamp == self.stamp:
+            return
+        with self.lock:
+            games = {}
+            if os.path.isdir(self.upload_dir):
+                for game_name in os.listdir(self.upload_dir):
+                    if not os.path.isdir(os.path.join(self.upload_dir, game_name)):
+                        continue
+                    meta = self._load_meta(game_name)
+                    if meta:
+                        games[game_name] = meta
+            self.games = games
+            self.stamp = stamp
+            self._rebuild_list()
+
+    def _rebuild_list(self):
+        result = [{
+            "game_name": game_name,
+            "developer": meta.get("developer", "unknown"),
+            "latest_version": meta.get("latest_version")
+        } for game_name, meta in sorted(self.games.items())]
+        self.list_body = json.dumps({"games": result}, ensure_ascii=False).encode("utf-8")
+        etag = hashlib.sha1(self.list_body).hexdigest()
+        if etag != self.etag:
+            self.etag = etag
+            self.last_modified = time.time()
+
+    # ------------------------------
+    # 更新（由改動遊戲的一方呼叫）
+    # ------------------------------
+    def update(self, game_name):
+        """重新載入一款遊戲的 meta.json（資料夾已刪除則移除），並通知其他 process"""
+        with self.lock:
+            meta = self._load_meta(game_name)
+            if meta:
+                self.games[game_name] = meta
+            else:
+                self.games.pop(game_name, None)
+            self._rebuild_list()
+            self._bump_version()
+
+    def _bump_version(self):
+        stamp = self._read_stamp()
+        version = int(stamp[1]) + 1 if stamp and stamp[1].isdigit() else 1
+        tmp_path = self.version_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_path, self.version_path)
+        self.stamp = self._read_stamp()
+
+    # ------------------------------
+    # 查詢
+    # ------------------------------
+    def get(self, game_name):
+        """回傳 meta 的複本；遊戲不存在時回傳 None"""
+        self.refresh()
+        meta = self.games.get(game_name)
+        return dict(meta) if meta else None
+
+    def games_of(self, developer):
+        self.refresh()
+        return {name: meta for name, meta in self.games.items() if meta.get("developer") == developer}
@@ -1,13 +1,26 @@
 from flask import Flask, request, jsonify
-import os, shutil, zipfile, io, json
+import os, shutil, zipfile, json, tempfile
 from accounts import AccountManager
+from storage import open_storage
+from catalog import Catalog
+from artifacts import build_artifact
+from blobs import ingest_version, missing_blobs, save_blob, materialize, safe_relpath, is_sha256
 
 app = Flask(__name__)
 UPLOAD_DIR = "uploaded_games"  # 所有開發者遊戲存放根目錄
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# 上傳限制：請求本身超過 MAX_UPLOAD_SIZE 時 Flask 直接回 413；
+# 上傳的檔案由 werkzeug 寫到磁碟暫存檔，解壓時直接從暫存檔讀取
+MAX_UPLOAD_SIZE = 512 * 1024 * 1024      # 上傳封包大小上限
+MAX_EXTRACTED_SIZE = 1024 * 1024 * 1024  # 解壓後總大小上限
+MAX_UPLOAD_FILES = 10000                 # 封包內檔案數上限
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE
+
 # Developer 帳號管理
-dev_manager = AccountManager("developer")
+dev_manager = AccountManager("developer", open_storage())
+# 商城目錄索引；改動遊戲後 update() 會通知 lobby 重新載入
+catalog = Catalog(UPLOAD_DIR)
 
 
 # ==========================
@@ -31,6 +44,44 @@ def save_meta(username, game_name, meta):
         json.dump(meta, f, indent=4, ensure_ascii=False)
 
 
+def extract_upload(file, dest):
+    """從上傳的暫存檔直接解壓到 dest（不把整個 zip 讀進記憶體），回傳錯誤訊息，成功時回傳 None"""
+    try:
+        with zipfile.ZipFile(file.stream) as zip_ref:
+            infos = zip_ref.infolist()
+            if len(infos) > MAX_UPLOAD_FILES:
+                return "封包內檔案數量過多"
+            if sum(info.file_size for info in infos) > MAX_EXTRACTED_SIZE:
+                return "封包解壓後大小超過上限"
+            zip_ref.extractall(dest)
+    except zipfile.BadZipFile:
+        return "上傳的檔案不是有效的 zip"
+    return None
+
+
+def extract_version(file, game_dir, version):
+    """解壓到新的暫存資料夾，完成後才換到版本資料夾的位置，回傳錯誤訊息，成功時回傳 None
+    已上架版本的檔案與 blob 庫、其他版本以 hardlink 共用同一個 inode，重新上傳時不可就地覆寫"""
+    os.makedirs(game_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=game_dir, prefix=".upload-")
+    try:
+        error = extract_upload(file, tmp_dir)
+        if error:
+            return error
+        version_dir = os.path.join(game_dir, version)
+        if os.path.exists(version_dir):
+            # 舊資料夾先移開再刪除，其他 hardlink 到這些檔案的地方不受影響
+            trash_dir = tempfile.mkdtemp(dir=game_dir, prefix=".old-")
+            os.rename(version_dir, os.path.join(trash_dir, version))
+            os.rename(tmp_dir, version_dir)
+            shutil.rmtree(trash_dir, ignore_errors=True)
+        else:
+            os.rename(tmp_dir, version_dir)
+        return None
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
 # ==========================
 # 註冊 / 登入 / 登出
 # ==========================
@@ -86,16 +137,15 @@ def upload_game():
 
         # 遊戲資料夾以遊戲名稱為主
         game_dir = os.path.join(UPLOAD_DIR, game_name)
-        version_dir = os.path.join(game_dir, version)
-        os.makedirs(version_dir, exist_ok=True)
 
-        # 解壓 zip 檔到版本資料夾
-        import io, zipfile
-        file = request.files['file']
-        file_bytes = io.BytesIO(file.read())
-        file_bytes.seek(0)
-        with zipfile.ZipFile(file_bytes, 'r') as zip_ref:
-            zip_ref.extractall(version_dir)
+        # 解壓 zip 檔到版本資料夾（同版本重新上傳時整個換掉）
+        error = extract_version(request.files['file'], game_dir, version)
+        if error:
+            return error, 400
+
+        # 上架時就建好下載用的封包，lobby 下載時只需送出檔案；檔案收進 blob 庫給之後的增量更新比對
+        build_artifact(UPLOAD_DIR, game_name, version)
+        ingest_version(UPLOAD_DIR, game_name, version)
 
         # 建立或更新 meta.json
         import json
@@ -118,6 +168,7 @@ def upload_game():
 
         with open(meta_path, "w", encoding="utf-8") as f:
             json.dump(meta, f, ensure_ascii=False, indent=2)
+        catalog.update(game_name)
 
         return f"遊戲 {game_name} 上架成功，版本 {version}"
 
@@ -130,63 +181,148 @@ def upload_game():
 # ==========================
 # 更新遊戲版本 (D2)
 # ==========================
+def check_update(username, game_name, new_version):
+    """檢查能否新增版本；回傳 (meta, 錯誤訊息, status code)"""
+    if not dev_manager.is_logged_in(username):
+        return None, "請先登入", 403
+
+    game_dir = os.path.join(UPLOAD_DIR, game_name)
+    if not game_name or not os.path.exists(game_dir):
+        return None, "無此遊戲可更新", 404
+
+    # 驗證開發者身份
+    meta_path = os.path.join(game_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None, "meta.json 不存在，無法驗證開發者", 500
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("developer") != username:
+        return None, "無權限更新此遊戲", 403
+
+    # 驗證版本號
+    if not new_version or new_version.strip() == "":
+        return None, "版本號不可為空", 400
+    if "/" in new_version or "\\" in new_version or new_version.startswith("."):
+        return None, "版本號格式錯誤", 400
+    if os.path.exists(os.path.join(game_dir, new_version)):
+        return None, "版本號已存在", 400
+    return meta, None, 200
+
+
+def publish_version(game_name, meta, new_version, form):
+    """版本資料夾已就緒：建立下載封包、收進 blob 庫、更新 meta.json 並通知商城目錄"""
+    build_artifact(UPLOAD_DIR, game_name, new_version)
+    # 之後的增量更新只需上傳與已上架版本不同的檔案
+    ingest_version(UPLOAD_DIR, game_name, new_version)
+
+    new_description = form.get("description", "")
+    meta["latest_version"] = new_version
+    meta["description"] = new_description or meta.get("description", "")
+    meta["type"] = form.get("type", "CLI")
+    meta["max_players"] = int(form.get("max_players", 1))
+    meta["config"] = form.get("config", "{}")
+    meta.setdefault("versions", {})[new_version] = new_description
+
+    meta_path = os.path.join(UPLOAD_DIR, game_name, "meta.json")
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    catalog.update(game_name)
+
+
 @app.route("/update_game", methods=["POST"])
 def update_game():
     try:
         username = request.form.get("username")
         game_name = request.form.get("game_name")
         new_version = request.form.get("new_version")
-        new_description = request.form.get("description", "")
-        game_type = request.form.get("type", "CLI")
-        max_players = int(request.form.get("max_players", 1))
-        config_data = request.form.get("config", "{}")
 
-        if not dev_manager.is_logged_in(username):
-            return "請先登入", 403
+        meta, error, status = check_update(username, game_name, new_version)
+        if error:
+            return error, status
 
-        game_dir = os.path.join(UPLOAD_DIR, game_name)
-        if not os.path.exists(game_dir):
-            return "無此遊戲可更新", 404
+        # 解壓新版本（解壓完成才出現版本資料夾）
+        error = extract_version(request.files['file'], os.path.join(UPLOAD_DIR, game_name), new_version)
+        if error:
+            return error, 400
 
-        # 驗證開發者身份
-        meta_path = os.path.join(game_dir, "meta.json")
-        if not os.path.exists(meta_path):
-            return "meta.json 不存在，無法驗證開發者", 500
-        import json
-        with open(meta_path, "r", encoding="utf-8") as f:
-            meta = json.load(f)
-        if meta.get("developer") != username:
-            return "無權限更新此遊戲", 403
-
-        # 驗證版本號
-        if not new_version or new_version.strip() == "":
-            return "版本號不可為空", 400
-        version_path = os.path.join(game_dir, new_version)
-        if os.path.exists(version_path):
-            return "版本號已存在", 400
-
-        # 建立新版本資料夾
-        os.makedirs(version_path, exist_ok=True)
-
-        # 解壓新版本
-        import io, zipfile
-        file = request.files['file']
-        file_bytes = io.BytesIO(file.read())
-        file_bytes.seek(0)
-        with zipfile.ZipFile(file_bytes, 'r') as zip_ref:
-            zip_ref.extractall(version_path)
-
-        # 更新 meta.json
-        meta["latest_version"] = new_version
-        meta["description"] = new_description or meta.get("description", "")
-        meta["type"] = game_type
-        meta["max_players"] = max_players
-        meta["config"] = config_data
-        meta.setdefault("versions", {})[new_version] = new_description
+        publish_version(game_name, meta, new_version, request.form)
+        return f"遊戲 {game_name} 已更新到版本 {new_version}"
+
+    except Exception as e:
+        import traceback
+        print(traceback.format_exc())
+        return f"伺服器錯誤: {e}", 500
 
-        with open(meta_path, "w", encoding="utf-8") as f:
-            json.dump(meta, f, ensure_ascii=False, indent=2)
 
+# ==========================
+# 增量更新：
+#   1. /update_game/manifest：client 送出新版本的檔案清單，server 回傳 blob 庫缺少的 hash
+#   2. /update_game/blob/<game>/<sha256>：逐一上傳缺少的檔案（請求內容即檔案本身）
+#   3. /update_game/commit：從 blob 庫組出新版本並上架
+# ==========================
+def check_file_list(files):
+    """檢查 client 送來的檔案清單，回傳整理後的清單或 None"""
+    if not isinstance(files, list) or not files or len(files) > MAX_UPLOAD_FILES:
+        return None
+    result = []
+    for f in files:
+        path = safe_relpath(f.get("path")) if isinstance(f, dict) else None
+        if path is None or not is_sha256(f.get("sha256")):
+            return None
+        result.append({"path": path, "sha256": f["sha256"]})
+    return result
+
+
+@app.route("/update_game/manifest", methods=["POST"])
+def update_game_manifest():
+    data = request.json
+    game_name = data.get("game_name")
+    meta, error, status = check_update(data.get("username"), game_name, data.get("new_version"))
+    if error:
+        return jsonify({"success": False, "message": error}), status
+    files = check_file_list(data.get("files"))
+    if files is None:
+        return jsonify({"success": False, "message": "檔案清單格式錯誤"}), 400
+
+    # 已上架的版本在上架時就收進 blob 庫，這裡只需比對 hash
+    missing = missing_blobs(UPLOAD_DIR, game_name, [f["sha256"] for f in files])
+    return jsonify({"success": True, "missing": missing})
+
+
+@app.route("/update_game/blob/<game_name>/<sha256>", methods=["PUT"])
+def update_game_blob(game_name, sha256):
+    username = request.args.get("username")
+    if not dev_manager.is_logged_in(username):
+        return jsonify({"success": False, "message": "請先登入"}), 403
+    meta = catalog.get(game_name)
+    if not meta or meta.get("developer") != username:
+        return jsonify({"success": False, "message": "無權限更新此遊戲"}), 403
+    if not is_sha256(sha256):
+        return jsonify({"success": False, "message": "hash 格式錯誤"}), 400
+
+    error = save_blob(UPLOAD_DIR, game_name, sha256, request.stream, MAX_UPLOAD_SIZE)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    return jsonify({"success": True})
+
+
+@app.route("/update_game/commit", methods=["POST"])
+def update_game_commit():
+    try:
+        data = request.json
+        game_name = data.get("game_name")
+        new_version = data.get("new_version")
+        meta, error, status = check_update(data.get("username"), game_name, new_version)
+        if error:
+            return error, status
+        files = check_file_list(data.get("files"))
+        if files is None:
+            return "檔案清單格式錯誤", 400
+        if missing_blobs(UPLOAD_DIR, game_name, [f["sha256"] for f in files]):
+            return "仍有檔案尚未上傳", 409
+
+        materialize(UPLOAD_DIR, game_name, new_version, files)
+        publish_version(game_name, meta, new_version, data)
         return f"遊戲 {game_name} 已更新到版本 {new_version}"
 
     except Exception as e:
@@ -223,6 +359,7 @@ def remove_game():
         return "無權限更新此遊戲", 403
 
     shutil.rmtree(game_dir)
+    catalog.update(game_name)
     return jsonify({"success": True, "message": f"遊戲 {game_name} 已下架"})
 
 
@@ -236,19 +373,12 @@ def list_my_games():
         return jsonify({"games": []})
 
     games = []
-    for game_name in os.listdir(UPLOAD_DIR):
-        game_dir = os.path.join(UPLOAD_DIR, game_name)
-        meta_path = os.path.join(game_dir, "meta.json")
-        if os.path.isdir(game_dir) and os.path.exists(meta_path):
-            import json
-            with open(meta_path, "r", encoding="utf-8") as f:
-                meta = json.load(f)
-            if meta.get("developer") == username:
-                games.append({
-                    "game_name": game_name,
-                    "latest_version": meta.get("latest_version"),
-                    "description": meta.get("description", "")
-                })
+    for game_name, meta in sorted(catalog.games_of(username).items()):
+        games.append({
+            "game_name": game_name,
+            "latest_version": meta.get("latest_version"),
+            "description": meta.get("description", "")
+        })
 
     return jsonify({"games": games})
 
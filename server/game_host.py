@@ -0,0 +1,331 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import queue
+import importlib.util
+
+# ============================================================
+# 多房間 game host
+#   - worker：一個常駐的 Python process 只載入一款遊戲（一個版本）的 game_server.py 一次，
+#     每個房間在自己的 thread 與 port 上執行一個 server 實例
+#   - GameHostPool（lobby 端）：依 game_server.py 路徑管理 worker，新房間分派給還有空位的 worker
+# lobby 與 worker 之間以 stdin / stdout 傳送 JSON lines
+# ============================================================
+
+MAX_ROOMS_PER_HOST = 32
+START_TIMEOUT = 10
+WARM_SPARE_HOSTS = 1     # 每個熱門遊戲版本至少保留幾個還有空位、已載入好遊戲的 worker
+WARM_CHECK_INTERVAL = 5  # 背景補充 worker 的檢查間隔（秒）
+HOST_IDLE_TIMEOUT = 300  # 沒有房間的 worker 閒置多久後結束（預熱保留的不算）
+WARM_PATH_TTL = 1800     # 遊戲版本多久沒有開新房間就不再預熱（秒）
+
+
+def find_server_class(module):
+    """優先使用 GameServer，否則找模組中定義、名稱以 Server 結尾且有 start() 的類別"""
+    cls = getattr(module, "GameServer", None)
+    if isinstance(cls, type):
+        return cls
+    for name, obj in vars(module).items():
+        if isinstance(obj, type) and name.endswith("Server") and obj.__module__ == module.__name__ \
+                and hasattr(obj, "start"):
+            return obj
+    return None
+
+
+def load_game_module(game_server_path):
+    # 遊戲會 import 同資料夾的模組（protocol、aio ...），所以 worker 一次只載入一款遊戲
+    game_dir = os.path.dirname(os.path.abspath(game_server_path))
+    sys.path.insert(0, game_dir)
+    spec = importlib.util.spec_from_file_location("game_server", game_server_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["game_server"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# ------------------------------
+# Worker
+# ------------------------------
+def worker_main(game_server_path):
+    # stdout 保留給控制訊息，遊戲 server 的 print 改到 stderr
+    control_out = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    sys.stdout = sys.stderr
+    out_lock = threading.Lock()
+
+    def reply(obj):
+        with out_lock:
+            control_out.write(json.dumps(obj) + "\n")
+            control_out.flush()
+
+    server_cls = find_server_class(load_game_module(game_server_path))
+    if server_cls is None:
+        reply({"event": "error", "message": "找不到 GameServer 類別"})
+        return
+    # 遊戲已載入完成，之後開房間只需要建立 server 實例
+    reply({"event": "ready"})
+
+    servers = {}  # room_id -> server 實例
+
+    def run_room(room_id, server):
+        error = None
+        try:
+            server.start()
+        except Exception as e:
+            error = str(e)
+        servers.pop(room_id, None)
+        reply({"event": "room_finished", "room_id": room_id, "error": error})
+
+    for line in sys.stdin:
+        try:
+            cmd = json.loads(line)
+        except ValueError:
+            continue
+        if cmd.get("cmd") == "stop":
+            # 遊戲 server 提供 stop() 時呼叫它（會中斷連線，讓阻塞中的迴圈立即返回）；
+            # 沒有的話只能把 running 設為 False，等主迴圈下次檢查時自行結束
+            server = servers.get(cmd.get("room_id"))
+            if server is None:
+                # 已結束或從未開成功的房間：回報結束，讓 lobby 端清掉登記
+                reply({"event": "room_finished", "room_id": cmd.get("room_id"), "error": "房間不存在"})
+                continue
+            try:
+                if hasattr(server, "stop"):
+                    server.stop()
+                elif hasattr(server, "running"):
+                    server.running = False
+            except Exception as e:
+                print(f"[GameHost] 結束房間 {cmd.get('room_id')} 失敗: {e}")
+            continue
+        if cmd.get("cmd") != "start":
+            continue
+        room_id = cmd["room_id"]
+        try:
+            server = server_cls(host=cmd["host"], port=cmd["port"], max_players=cmd["max_players"])
+            servers[room_id] = server
+            threading.Thread(target=run_room, args=(room_id, server), daemon=True).start()
+            reply({"event": "started", "room_id": room_id, "ok": True})
+        except Exception as e:
+            reply({"event": "started", "room_id": room_id, "ok": False, "message": str(e)})
+
+
+# ------------------------------
+# Lobby 端
+# ------------------------------
+class GameHost:
+    """一個 worker process 的代理"""
+    def __init__(self, game_server_path, on_event=None):
+        self.game_server_path = game_server_path
+        self.on_event = on_event
+        self.rooms = set()
+        self.idle_since = time.monotonic()  # 沒有房間時開始計時；有房間時為 None
+        self.replies = queue.Queue()
+        self.lock = threading.Lock()       # 保護 rooms
+        self.send_lock = threading.Lock()  # 一次只處理一個 start 指令
+        self.write_lock = threading.Lock() # 寫入 stdin；stop 指令不必等 start 的回覆
+        self.ready = threading.Event()     # worker 已載入遊戲模組
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--game_server", game_server_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8"
+        )
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _read_loop(self):
+        for line in self.proc.stdout:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if msg.get("event") == "started":
+                self.replies.put(msg)
+                continue
+            if msg.get("event") == "ready":
+                self.ready.set()
+                continue
+            if msg.get("event") == "room_finished":
+                self._forget_room(msg.get("room_id"))
+            if self.on_event:
+                self.on_event(msg)
+        # worker 結束：通知所有房間已結束
+        self.replies.put({"event": "started", "ok": False, "message": "game host 已結束"})
+        with self.lock:
+            rooms, self.rooms = self.rooms, set()
+        if self.on_event:
+            for room_id in rooms:
+                self.on_event({"event": "room_finished", "room_id": room_id, "error": "game host 已結束"})
+
+    def start_room(self, room_id, host, port, max_players):
+        with self.send_lock:
+            # 送出指令前就先登記：遊戲 start() 立即失敗時，room_finished 可能比 started 的回覆先被處理
+            with self.lock:
+                self.rooms.add(room_id)
+                self.idle_since = None
+            cmd = {"cmd": "start", "room_id": room_id, "host": host, "port": port, "max_players": max_players}
+            try:
+                self._send(cmd)
+            except OSError as e:
+                self._forget_room(room_id)
+                return False, str(e)
+            while True:
+                try:
+                    reply = self.replies.get(timeout=START_TIMEOUT)
+                except queue.Empty:
+                    # worker 可能之後才開起來，保留登記；不存在的話 stop_room 時 worker 會回覆 room_finished
+                    return False, "game host 沒有回應"
+                # 略過先前逾時的指令遲來的回覆
+                if reply.get("room_id") in (room_id, None):
+                    break
+            if reply.get("ok"):
+                return True, "ok"
+            self._forget_room(room_id)
+            return False, reply.get("message", "啟動失敗")
+
+    def _forget_room(self, room_id):
+        with self.lock:
+            self.rooms.discard(room_id)
+            if not self.rooms and self.idle_since is None:
+                self.idle_since = time.monotonic()
+
+    def stop_room(self, room_id):
+        """請 worker 結束一個房間；結束後會收到 room_finished"""
+        try:
+            self._send({"cmd": "stop", "room_id": room_id})
+        except OSError:
+            pass
+
+    def _send(self, cmd):
+        with self.write_lock:
+            self.proc.stdin.write(json.dumps(cmd) + "\n")
+            self.proc.stdin.flush()
+
+    def stop(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.terminate()
+
+
+class GameHostPool:
+    """依遊戲版本（game_server.py 路徑）管理 worker；同一版本的房間共用 worker，滿了才再開新的
+    warm() 過的遊戲版本會在背景維持 warm_spares 個還有空位的 worker，開房間時不必等 Python 啟動與載入遊戲；
+    超過 WARM_PATH_TTL 沒有再 warm() 的版本（例如已更新的舊版本）不再預熱，閒置的 worker 由 trim() 結束"""
+    def __init__(self, max_rooms_per_host=MAX_ROOMS_PER_HOST, on_event=None, warm_spares=WARM_SPARE_HOSTS):
+        self.max_rooms_per_host = max_rooms_per_host
+        self.on_event = on_event
+        self.warm_spares = warm_spares
+        self.hosts = {}  # game_server_path -> [GameHost]
+        self.warm_paths = {}  # game_server_path -> 最後一次 warm() 的時間（monotonic）
+        self.lock = threading.Lock()
+        self.replenish = threading.Event()
+        if warm_spares > 0:
+            threading.Thread(target=self._warm_loop, daemon=True).start()
+
+    def _live_hosts(self, game_server_path):
+        hosts = [h for h in self.hosts.get(game_server_path, []) if h.alive()]
+        self.hosts[game_server_path] = hosts
+        return hosts
+
+    def _pick_host(self, game_server_path):
+        with self.lock:
+            hosts = self._live_hosts(game_server_path)
+            # 優先使用已載入完成的 worker
+            free = [h for h in hosts if len(h.rooms) < self.max_rooms_per_host]
+            free.sort(key=lambda h: not h.ready.is_set())
+            if free:
+                # 重新計算閒置時間，避免選中後還沒開房間就被 trim() 結束
+                if free[0].idle_since is not None:
+                    free[0].idle_since = time.monotonic()
+                return free[0]
+            h = GameHost(game_server_path, on_event=self.on_event)
+            hosts.append(h)
+            return h
+
+    def warm(self, game_server_path):
+        """標記為熱門遊戲版本，背景預先啟動 worker"""
+        with self.lock:
+            self.warm_paths[os.path.abspath(game_server_path)] = time.monotonic()
+        self.replenish.set()
+
+    def _warm_loop(self):
+        while True:
+            self.replenish.wait(WARM_CHECK_INTERVAL)
+            self.replenish.clear()
+            now = time.monotonic()
+            with self.lock:
+                # 一段時間沒開新房間的版本不再預熱，剩下的空閒 worker 之後由 trim() 結束
+                for path, last in list(self.warm_paths.items()):
+                    if now - last > WARM_PATH_TTL:
+                        del self.warm_paths[path]
+                for path in self.warm_paths:
+                    hosts = self._live_hosts(path)
+                    spares = sum(1 for h in hosts if len(h.rooms) < self.max_rooms_per_host)
+                    for _ in range(self.warm_spares - spares):
+                        hosts.append(GameHost(path, on_event=self.on_event))
+
+    def start_room(self, game_server_path, room_id, host, port, max_players):
+        game_server_path = os.path.abspath(game_server_path)
+        ok, msg = self._pick_host(game_server_path).start_room(room_id, host, port, max_players)
+        # 用掉空位後在背景補足預熱的 worker
+        self.warm(game_server_path)
+        return ok, msg
+
+    def active_rooms(self):
+        """目前還在執行的房間 id"""
+        with self.lock:
+            hosts = [h for hosts in self.hosts.values() for h in hosts if h.alive()]
+        rooms = set()
+        for h in hosts:
+            with h.lock:
+                rooms |= h.rooms
+        return rooms
+
+    def stop_room(self, room_id):
+        with self.lock:
+            hosts = [h for hosts in self.hosts.values() for h in hosts]
+        for h in hosts:
+            if room_id in h.rooms:
+                h.stop_room(room_id)
+                return True
+        return False
+
+    def trim(self, idle_timeout=HOST_IDLE_TIMEOUT):
+        """結束閒置過久、沒有房間的 worker；預熱中的遊戲版本保留 warm_spares 個"""
+        now = time.monotonic()
+        with self.lock:
+            for path in list(self.hosts):
+                hosts = self._live_hosts(path)
+                keep = self.warm_spares if path in self.warm_paths else 0
+                for h in hosts[:]:
+                    idle = h.idle_since is not None and now - h.idle_since > idle_timeout
+                    # 正在開房間的 worker（持有 send_lock）不動
+                    if not idle or h.send_lock.locked():
+                        continue
+                    spares = sum(1 for x in hosts if len(x.rooms) < self.max_rooms_per_host)
+                    if spares <= keep:
+                        break
+                    h.stop()
+                    hosts.remove(h)
+                if not hosts:
+                    del self.hosts[path]
+
+    def shutdown(self):
+        with self.lock:
+            self.warm_paths = {}
+            for hosts in self.hosts.values():
+                for h in hosts:
+                    h.stop()
+            self.hosts = {}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--game_server", required=True)
+    args = parser.parse_args()
+    worker_main(args.game_server)
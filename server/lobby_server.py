@@ -1,19 +1,44 @@
 from flask import Flask, send_file, jsonify, request
 import os
-import shutil
 from accounts import AccountManager  # 永久化帳號 + session
+from storage import open_storage
 import json
+import hashlib
+import time
 from uuid import uuid4
-from room_manager import RoomManager
-import subprocess
+from room_manager import RoomManager, ROOM_SUMMARY_FIELDS
+from game_host import GameHostPool
+from catalog import Catalog
+from room_events import RoomEventLog
+from room_reaper import RoomReaper
+from artifacts import get_manifest, artifact_path, build_delta
 
 app = Flask(__name__)
 UPLOAD_DIR = "uploaded_games"
 ROOMS_FILE = "rooms.json"
+MAX_EVENT_WAIT = 30  # /lobby/room_events 最長等待秒數
 
 # Player 帳號管理（永久保存帳號和登入 session）
-player_manager = AccountManager("player")
-room_manager = RoomManager()
+storage = open_storage()  # 環境變數 STORAGE_BACKEND=sqlite 時改用 SQLite
+player_manager = AccountManager("player", storage)
+# 房間事件（long-poll 推送給等待房間狀態的 client）
+room_events = RoomEventLog()
+room_manager = RoomManager(storage, on_event=lambda *args, **data: on_room_event(*args, **data))
+review_store = storage.review_store()
+# 商城目錄索引（developer server 改動遊戲後會通知重新載入）
+catalog = Catalog(UPLOAD_DIR)
+# 常駐的 game host worker：每個遊戲版本載入一次，多個房間共用同一個 process
+# 遊戲 server 結束時由 reaper 釋放房間（room_reaper 在下面建立，事件只會在開房間之後才出現）
+game_hosts = GameHostPool(on_event=lambda msg: room_reaper.on_game_event(msg))
+# 回收已結束、閒置或超時的房間；在實際處理請求的 process 啟動（見 __main__）
+room_reaper = RoomReaper(room_manager, game_hosts)
+
+
+def on_room_event(event_type, room_id, **data):
+    room_events.publish(event_type, room_id, **data)
+    # 房間被刪除（例如玩家都離開了）時，遊戲 server 若還在執行就結束它，釋放 thread 與 port
+    if event_type == "deleted":
+        game_hosts.stop_room(room_id)
 
 # --------------------------
 # 帳號路由
@@ -51,12 +76,22 @@ def logout():
 # Helper：讀取遊戲 metadata.json
 # ============================================================
 def load_metadata(game_name):
-    meta_path = os.path.join(UPLOAD_DIR, game_name, "meta.json")
-    if not os.path.exists(meta_path):
-        return None
+    return catalog.get(game_name)
 
-    with open(meta_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+
+def version_exists(meta, game_name, version):
+    """版本需在 meta.json 中登記過且資料夾存在（也避免用 client 給的版本字串組出任意路徑）"""
+    return version in meta.get("versions", {}) and os.path.isdir(os.path.join(UPLOAD_DIR, game_name, version))
+
+
+def not_modified(etag, last_modified=None):
+    """依 If-None-Match / If-Modified-Since 判斷 client 的快取是否仍有效
+    （Response.make_conditional 只處理 GET，POST 的下載路由用這個自己判斷）"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
     
 
 # ============================================================
@@ -64,26 +99,12 @@ def load_metadata(game_name):
 # ============================================================
 @app.route("/store/games", methods=["GET"])
 def store_games():
-    if not os.path.exists(UPLOAD_DIR):
-        return jsonify({"games": []})
-
-    result = []
-    for game_name in os.listdir(UPLOAD_DIR):
-        game_dir = os.path.join(UPLOAD_DIR, game_name)
-        if not os.path.isdir(game_dir):
-            continue
-
-        meta = load_metadata(game_name)
-        if not meta:
-            continue
-
-        result.append({
-            "game_name": game_name,
-            "developer": meta.get("developer", "unknown"),
-            "latest_version": meta.get("latest_version")
-        })
-
-    return jsonify({"games": result})
+    # 目錄沒變時直接回傳快取的 JSON；client 帶相同 ETag 時回 304
+    catalog.refresh()
+    resp = app.response_class(catalog.list_body, mimetype="application/json")
+    resp.set_etag(catalog.etag)
+    resp.last_modified = catalog.last_modified
+    return resp.make_conditional(request)
 
 # ============================================================
 # 商城：取得遊戲詳細資訊
@@ -95,22 +116,26 @@ def store_game_detail(game_name):
         return jsonify({"error": "game not found or metadata missing"}), 404
 
     # 加入 review
-    review_file = os.path.join(UPLOAD_DIR, game_name, "reviews.json")
-    reviews = []
-    if os.path.exists(review_file):
-        reviews = json.load(open(review_file, "r", encoding="utf-8"))
-
-    meta["reviews"] = reviews
+    meta["reviews"] = review_store.list(game_name)
     meta["latest_version"] = meta.get("latest_version")
 
-    return jsonify(meta)
+    # 評論也會改變內容，ETag 直接取整個回應的 hash
+    resp = jsonify(meta)
+    resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest())
+    return resp.make_conditional(request)
 
 # ============================================================
-# 玩家下載遊戲（自動給最新版本）
+# 玩家下載遊戲（預設為最新版本，可用 version 指定房間使用的版本）
 # ============================================================
-@app.route("/player/download/<game_name>", methods=["POST"])
+@app.route("/player/download/<game_name>", methods=["GET", "POST"])
 def player_download(game_name):
-    username = request.json.get("username")
+    # GET（username 放在 query）支援 Range / If-Range 續傳；POST 保留給舊版 client
+    if request.method == "GET":
+        username = request.args.get("username")
+        version = request.args.get("version")
+    else:
+        username = request.json.get("username")
+        version = request.json.get("version")
 
     if not player_manager.is_logged_in(username):
         return jsonify({"success": False, "message": "請先登入"}), 403
@@ -119,21 +144,85 @@ def player_download(game_name):
     if not meta:
         return jsonify({"success": False, "message": "遊戲不存在"}), 404
 
-    latest = meta.get("latest_version")
-    version_dir = os.path.join(UPLOAD_DIR, game_name, latest)
+    version = version or meta.get("latest_version")
+
+    # 封包在上架時已建好；舊版本沒有封包時補建一次（寫入是 atomic，併發請求不會互相干擾）
+    if not version_exists(meta, game_name, version):
+        return jsonify({"success": False, "message": "遊戲版本不存在"}), 404
+    manifest = get_manifest(UPLOAD_DIR, game_name, version)
+    zip_path = artifact_path(UPLOAD_DIR, game_name, manifest)
+
+    etag = manifest["sha256"]
+    if request.method == "GET":
+        # send_file 會處理 If-None-Match（304）與 Range（206）
+        resp = send_file(zip_path, as_attachment=True, download_name=f"{game_name}_{version}.zip",
+                         conditional=True, etag=etag)
+        resp.headers["X-Content-SHA256"] = etag
+        return resp
+
+    # 已下載過同一份 zip 的 client 帶 If-None-Match 時回 304，不重送檔案
+    st = os.stat(zip_path)
+    if not_modified(etag, st.st_mtime):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    resp = send_file(zip_path, as_attachment=True, download_name=f"{game_name}_{version}.zip",
+                     conditional=False, etag=False)
+    resp.set_etag(etag)
+    resp.last_modified = st.st_mtime
+    return resp
 
-    # zip 位置
-    zip_path = os.path.join(UPLOAD_DIR, f"{game_name}_{latest}.zip")
+# ============================================================
+# 版本檔案清單（路徑、大小、hash）
+# ============================================================
+@app.route("/store/game/<game_name>/manifest/<version>", methods=["GET"])
+def store_game_manifest(game_name, version):
+    meta = load_metadata(game_name)
+    if not meta or not version_exists(meta, game_name, version):
+        return jsonify({"error": "game or version not found"}), 404
 
-    # 打包 zip（如果不存在）
-    if not os.path.exists(zip_path):
-        shutil.make_archive(
-            base_name=os.path.join(UPLOAD_DIR, f"{game_name}_{latest}"),
-            format="zip",
-            root_dir=version_dir
-        )
+    manifest = get_manifest(UPLOAD_DIR, game_name, version)
+    resp = jsonify(manifest)
+    resp.set_etag(manifest["sha256"])
+    return resp.make_conditional(request)
 
-    return send_file(zip_path, as_attachment=True)
+# ============================================================
+# 差異下載：玩家已有舊版本時只下載變動的檔案
+# ============================================================
+@app.route("/player/download_delta/<game_name>", methods=["POST"])
+def player_download_delta(game_name):
+    username = request.json.get("username")
+    from_version = request.json.get("from_version")
+    to_version = request.json.get("to_version")
+
+    if not player_manager.is_logged_in(username):
+        return jsonify({"success": False, "message": "請先登入"}), 403
+
+    meta = load_metadata(game_name)
+    if not meta:
+        return jsonify({"success": False, "message": "遊戲不存在"}), 404
+    # 未指定目標版本時更新到最新版本
+    to_version = to_version or meta.get("latest_version")
+    if not version_exists(meta, game_name, to_version):
+        return jsonify({"success": False, "message": "遊戲版本不存在"}), 404
+    if not version_exists(meta, game_name, from_version):
+        # client 收到 404 後改為完整下載
+        return jsonify({"success": False, "message": "舊版本不存在，請完整下載"}), 404
+
+    new_manifest = get_manifest(UPLOAD_DIR, game_name, to_version)
+    if from_version == to_version:
+        resp = app.response_class(status=304)
+        resp.set_etag(new_manifest["sha256"])
+        return resp
+
+    old_manifest = get_manifest(UPLOAD_DIR, game_name, from_version)
+    delta_path = build_delta(UPLOAD_DIR, game_name, old_manifest, new_manifest)
+    resp = send_file(delta_path, as_attachment=True, download_name=f"{game_name}_{from_version}_{to_version}.delta.zip",
+                     conditional=False, etag=False)
+    # ETag 與完整下載相同，組裝後的版本可直接以它重新驗證
+    resp.set_etag(new_manifest["sha256"])
+    return resp
 
 # ============================================================
 # 紀錄玩家遊玩過的遊戲
@@ -171,18 +260,11 @@ def store_review(game_name):
     if not player_manager.has_played(username, game_name):
         return jsonify({"success": False, "message": "你尚未玩過此遊戲，無法評論！"}), 403
 
-    review_file = os.path.join(UPLOAD_DIR, game_name, "reviews.json")
-    reviews = []
-    if os.path.exists(review_file):
-        reviews = json.load(open(review_file, "r", encoding="utf-8"))
-
-    reviews.append({
+    review_store.add(game_name, {
         "user": username,
         "rating": rating,
         "comment": comment
     })
-
-    json.dump(reviews, open(review_file, "w", encoding="utf-8"), ensure_ascii=False)
     return jsonify({"success": True, "message": "評論成功"})
 
 
@@ -229,6 +311,9 @@ def create_room():
     if not ok:
         return {"error": msg}, 400
 
+    # 房主接著就會 start_room，先在背景預熱這個遊戲版本的 game host
+    game_hosts.warm(room_manager.get_room(room_id)["game_server_path"])
+
     return {"room_id": room_id}
 
 @app.route("/lobby/start_room", methods=["POST"])
@@ -239,6 +324,8 @@ def start_room():
     room = room_manager.get_room(room_id)
     if not room:
         return jsonify({"error": "room not found"}), 404
+    if not room_manager.begin_start(room_id):
+        return jsonify({"error": "房間已啟動或已結束"}), 409
     max_players = room["max_players"]
     game_name = room["game_name"]
     version = room["version"]
@@ -252,22 +339,18 @@ def start_room():
     port = s.getsockname()[1]
     s.close()
 
-    # start game server subprocess
-    cmd = [
-        "python", GAME_SERVER_PATH,
-        "--host", "140.113.17.11",
-        "--port", str(port),
-        "--max_players", str(max_players)
-    ]
-
-    print("[Lobby] Starting game server:", " ".join(cmd))
-    proc = subprocess.Popen(cmd)
+    # 交給 game host worker 在新 port 上開一個房間
+    print(f"[Lobby] Starting room {room_id} on port {port}: {GAME_SERVER_PATH}")
+    ok, msg = game_hosts.start_room(GAME_SERVER_PATH, room_id, "140.113.17.11", port, max_players)
+    if not ok:
+        room_manager.set_status(room_id, "waiting")
+        return jsonify({"error": f"啟動遊戲伺服器失敗: {msg}"}), 500
 
-    # save host info
-    room["host_addr"] = "140.113.17.11"
-    room["host_port"] = port
-    room["status"] = "running"
-    room_manager._save()
+    # save host info；啟動期間房間可能已被刪除（玩家都離開）或遊戲 server 已經結束
+    if not room_manager.set_status(room_id, "running", host_addr="140.113.17.11", host_port=port,
+                                   started_at=time.time()):
+        game_hosts.stop_room(room_id)
+        return jsonify({"error": "房間已不存在"}), 404
 
     return jsonify({
         "status": "ok",
@@ -279,10 +362,39 @@ def start_room():
 
 @app.route("/lobby/list_rooms", methods=["GET"])
 def list_rooms():
-    rooms = room_manager.get_rooms()
-    if rooms is None:
-        return jsonify({"success": False, "message": "rooms not found"}), 404
-    return jsonify({"success": True, "rooms": rooms})
+    """query 參數：
+    game / version：遊戲與版本；status：狀態，可用逗號分隔多個；has_slot=1：只列出未滿的房間
+    sort：created / players / room_id，order=desc 反向；limit：每頁筆數；cursor：上一頁回傳的 next_cursor
+    fields：要回傳的欄位（逗號分隔），full 為完整房間資料；預設為精簡欄位"""
+    args = request.args
+    statuses = [s for s in args.get("status", "").split(",") if s]
+    fields = args.get("fields")
+    if fields == "full":
+        fields = None
+    elif fields:
+        fields = fields.split(",")
+    else:
+        fields = ROOM_SUMMARY_FIELDS
+    try:
+        limit = int(args.get("limit", 20))
+    except ValueError:
+        return jsonify({"success": False, "message": "limit 必須是整數"}), 400
+
+    try:
+        rooms, next_cursor = room_manager.list_rooms(
+            game_name=args.get("game"),
+            version=args.get("version"),
+            statuses=statuses,
+            has_slot=args.get("has_slot") == "1",
+            sort=args.get("sort", "created"),
+            descending=args.get("order") == "desc",
+            cursor=args.get("cursor"),
+            limit=limit,
+            fields=fields,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "rooms": rooms, "next_cursor": next_cursor})
 
 @app.route("/lobby/join_room", methods=["POST"])
 def join_room():
@@ -290,25 +402,46 @@ def join_room():
     username = data["username"]
     room_id = data["room_id"]
 
+    # 先記下目前的事件編號，client 之後從這裡開始等房間事件，不會漏掉加入後才發生的變化
+    event_seq = room_events.latest_seq()
+
     # 取得房間資訊
     room = room_manager.get_room(room_id)
     if not room:
         return jsonify({"success": False, "message": "room not found"}), 404
 
-    # 檢查房間人數上限
-    if len(room["players"]) >= room["max_players"]:
+    # 檢查房間人數上限（已在房內的玩家重新查詢時不受影響）
+    if username not in room["players"] and len(room["players"]) >= room["max_players"]:
         return jsonify({"success": False, "message": "房間已滿"}), 403
 
-    # 將玩家加入房間
-    room["players"].append(username)
-    room_manager._save()
+    # 將玩家加入房間（由 RoomManager 維護 玩家 -> 房間 索引）
+    if username not in room["players"]:
+        ok, msg = room_manager.join_room(room_id, username)
+        if not ok:
+            return jsonify({"success": False, "message": msg}), 400
 
     return jsonify({
         "success": True,
         "message": f"已加入房間 {room_id}",
-        "room": room
+        "room": room,
+        "event_seq": event_seq
     })
 
+@app.route("/lobby/room_events", methods=["GET"])
+def get_room_events():
+    """long-poll 房間事件
+    query 參數：since：上次收到的 seq（預設 0）；room_id：只看某間房間；timeout：最長等待秒數
+    有新事件時立即回傳，否則等到逾時回傳空列表；reset 為 true 表示中間有事件已被丟棄，client 應重新查詢房間"""
+    args = request.args
+    try:
+        since = int(args.get("since", 0))
+        timeout = min(float(args.get("timeout", 25)), MAX_EVENT_WAIT)
+    except ValueError:
+        return jsonify({"success": False, "message": "since / timeout 必須是數字"}), 400
+
+    events, seq, reset = room_events.wait(since, room_id=args.get("room_id"), timeout=max(timeout, 0))
+    return jsonify({"success": True, "events": events, "seq": seq, "reset": reset})
+
 @app.route("/player/leave_room", methods=["POST"])
 def player_leave_room():
     data = request.json
@@ -327,4 +460,8 @@ if __name__ == "__main__":
     if not os.path.exists(UPLOAD_DIR):
         os.makedirs(UPLOAD_DIR)
 
-    app.run(host="0.0.0.0", port=6000, debug=True)
+    debug = True
+    # debug 模式下 reloader 的主 process 不處理請求，只在實際服務的 process 回收房間
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        room_reaper.start()
+    app.run(host="0.0.0.0", port=6000, debug=debug)
@@ -0,0 +1,50 @@
+import time
+from collections import deque
+from threading import Condition
+
+# ============================================================
+# 房間事件（long-poll）
+#   RoomManager 每次改動房間都會 publish 一筆事件，依序編號；
+#   client 帶上次看到的 seq 呼叫 /lobby/room_events，沒有新事件時 server 會等到有事件或逾時才回應
+# 事件種類：
+#   created / player_joined / player_left / host_changed / status（含 status、host_addr、host_port）/ deleted
+# ============================================================
+
+EVENT_BUFFER = 1000  # 保留最近幾筆事件；client 落後超過這個數量時要重新取得房間列表
+
+
+class RoomEventLog:
+    def __init__(self, maxlen=EVENT_BUFFER):
+        self.events = deque(maxlen=maxlen)
+        self.seq = 0
+        self.cond = Condition()
+
+    def latest_seq(self):
+        return self.seq
+
+    def publish(self, event_type, room_id, **data):
+        with self.cond:
+            self.seq += 1
+            event = {"seq": self.seq, "type": event_type, "room_id": room_id, "time": time.time()}
+            event.update(data)
+            self.events.append(event)
+            self.cond.notify_all()
+        return event
+
+    def _since(self, after_seq, room_id):
+        return [e for e in self.events
+                if e["seq"] > after_seq and (room_id is None or e["room_id"] == room_id)]
+
+    def wait(self, after_seq, room_id=None, timeout=25):
+        """回傳 (事件列表, 目前 seq, reset)；reset 為 True 表示 after_seq 之後的事件已有部分被丟棄"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                reset = bool(self.events) and self.events[0]["seq"] > after_seq + 1
+                events = self._since(after_seq, room_id)
+                if events or reset:
+                    return events, self.seq, reset
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], self.seq, False
+                self.cond.wait(remaining)
@@ -1,25 +1,69 @@
+import base64
 import json
-import os
+import time
 from threading import RLock
+from storage import JsonStorage
 
-ROOM_FILE = "rooms.json"
 LOCK = RLock()
 
-class RoomManager:
-    def __init__(self):
-        # 若檔案不存在 → 建立空字典
-        if not os.path.exists(ROOM_FILE):
-            with open(ROOM_FILE, "w") as f:
-                json.dump({}, f, indent=2)
+# list_rooms 預設回傳的精簡欄位（players 只回傳人數）
+ROOM_SUMMARY_FIELDS = ("room_id", "game_name", "version", "host", "status", "max_players", "player_count")
+ROOM_SORT_KEYS = {
+    "created": lambda room: room.get("created_at", 0),
+    "players": lambda room: len(room["players"]),
+    "room_id": lambda room: room["room_id"],
+}
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort, key):
+    """cursor 內含排序方式與上一頁最後一筆的 (排序鍵, room_id)"""
+    return base64.urlsafe_b64encode(json.dumps([sort, key[0], key[1]]).encode()).decode()
+
 
-        # 讀取現有房間資料
-        with open(ROOM_FILE, "r") as f:
-            self.rooms = json.load(f)
+def decode_cursor(cursor, sort):
+    """回傳 (排序鍵, room_id)；格式錯誤或是其他排序方式產生的 cursor 回傳 None"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, list) or len(data) != 3 or data[0] != sort:
+        return None
+    key, room_id = data[1], data[2]
+    if sort == "room_id":
+        valid = isinstance(key, str)
+    else:
+        valid = isinstance(key, (int, float)) and not isinstance(key, bool)
+    if not valid or not isinstance(room_id, str):
+        return None
+    return key, room_id
 
-    def _save(self):
+class RoomManager:
+    def __init__(self, storage=None, on_event=None):
+        # 房間常駐記憶體，變更時透過 storage 後端寫回（預設為 rooms.json）
+        # 啟動後不會再從 store 讀取，其他 process 的改動看不到也會被覆蓋：只支援單一 lobby process
+        self.store = (storage or JsonStorage()).room_store()
+        # on_event(event_type, room_id, **data)：房間有變動時通知（lobby 用來推送給等待中的 client）
+        self.on_event = on_event
+        self.rooms = self.store.load_all()
+        # username -> room_id 索引；每位玩家同時只會在一間房間
+        self.player_room = {}
+        # 遊戲 / 狀態 -> room_id 集合，給 list_rooms 篩選用
+        self.rooms_by_game = {}
+        self.rooms_by_status = {}
+        for room_id, room in self.rooms.items():
+            for username in room["players"]:
+                self.player_room[username] = room_id
+            self._index_room(room_id, room)
+
+    def _save(self, room_id=None):
+        """寫回 room_id 這間房間（已刪除則移除）；SQLite 後端只更新該列，JSON 後端整份重寫"""
         with LOCK:
-            with open(ROOM_FILE, "w") as f:
-                json.dump(self.rooms, f, indent=2)
+            self.store.save(self.rooms, room_id)
+
+    def _emit(self, event_type, room_id, **data):
+        if self.on_event:
+            self.on_event(event_type, room_id, **data)
 
     # -------------------------------
     # 房間操作
@@ -29,6 +73,7 @@ class RoomManager:
         with LOCK:
             if room_id in self.rooms:
                 return False, "房間已存在"
+            self._leave_current_room(host)
 
             game_server_path = f"uploaded_games/{game_name}/{version}/game_server.py"
 
@@ -39,13 +84,18 @@ class RoomManager:
                 "game_server_path": game_server_path,
                 "host": host,
                 "players": [host],
-                "status": "waiting",     # waiting / running / finished
+                "status": "waiting",     # waiting / starting / running / finished
                 "host_addr": None,
                 "host_port": None,
-                "max_players": maxplayers
+                "max_players": maxplayers,
+                "created_at": time.time(),
+                "last_active": time.time()   # 最後一次有玩家進出或狀態改變的時間，給 reaper 判斷閒置
             }
+            self.player_room[host] = room_id
+            self._index_room(room_id, self.rooms[room_id])
 
-            self._save()
+            self._save(room_id)
+            self._emit("created", room_id, game_name=game_name, version=version, host=host)
             return True, "建立成功"
 
     def join_room(self, room_id, username):
@@ -56,8 +106,13 @@ class RoomManager:
             if username in self.rooms[room_id]["players"]:
                 return False, "已在房間內"
 
+            self._leave_current_room(username)
             self.rooms[room_id]["players"].append(username)
-            self._save()
+            self.rooms[room_id]["last_active"] = time.time()
+            self.player_room[username] = room_id
+            self._save(room_id)
+            self._emit("player_joined", room_id, username=username,
+                       players=list(self.rooms[room_id]["players"]))
             return True, "加入成功"
 
     def leave_room(self, username):
@@ -69,34 +124,148 @@ class RoomManager:
 
             # 移除玩家
             self.remove_player_from_room(room_id, username)
+            room["last_active"] = time.time()
+            self._emit("player_left", room_id, username=username, players=list(room["players"]))
 
             # 若房間空了 → 刪除
             if len(room["players"]) == 0:
-                del self.rooms[room_id]
-                self._save()
+                self._drop_room(room_id)
+                self._save(room_id)
+                self._emit("deleted", room_id)
                 return True, f"房間 {room_id} 已無玩家，自動刪除"
 
             # 若房主離開 → 轉讓給第一位玩家
             if room["host"] == username:
                 room["host"] = room["players"][0]
-                self._save()
+                self._save(room_id)
+                self._emit("host_changed", room_id, host=room["host"])
                 return True, f"房主已離開，轉讓給 {room['host']}"
 
-            self._save()
+            self._save(room_id)
             return True, "離開房間成功"
 
+    def set_status(self, room_id, status, **fields):
+        """更新房間狀態（與其他欄位，如 host_addr / host_port）並維護狀態索引"""
+        with LOCK:
+            room = self.rooms.get(room_id)
+            if room is None:
+                return False
+            self._unindex_room(room_id, room)
+            room.update(fields)
+            room["status"] = status
+            room["last_active"] = time.time()
+            self._index_room(room_id, room)
+            self._save(room_id)
+            self._emit("status", room_id, status=status, **fields)
+            return True
+
+    def begin_start(self, room_id):
+        """waiting → starting；房間不存在或已經啟動時回傳 False，同一間房間不會被啟動兩次"""
+        with LOCK:
+            room = self.rooms.get(room_id)
+            if room is None or room["status"] != "waiting":
+                return False
+            return self.set_status(room_id, "starting")
+
+    def finish_room(self, room_id, reason=None):
+        """遊戲結束或逾時：先標記 finished 通知房內玩家，再釋放房間"""
+        with LOCK:
+            if room_id not in self.rooms:
+                return False
+            self.set_status(room_id, "finished", finish_reason=reason)
+            return self.delete_room(room_id)
+
+    def list_rooms(self, game_name=None, version=None, statuses=None, has_slot=False,
+                   sort="created", descending=False, cursor=None, limit=20, fields=ROOM_SUMMARY_FIELDS):
+        """篩選、排序並分頁；回傳 (房間列表, 下一頁 cursor 或 None)
+        cursor 為上一頁最後一筆的排序鍵，房間增減時分頁也不會重複或跳過；cursor 無效時拋出 ValueError"""
+        if sort not in ROOM_SORT_KEYS:
+            sort = "created"
+        sort_key = ROOM_SORT_KEYS[sort]
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        after = None
+        if cursor:
+            after = decode_cursor(cursor, sort)
+            if after is None:
+                raise ValueError("cursor 無效")
+        with LOCK:
+            candidates = None
+            if game_name is not None:
+                candidates = set(self.rooms_by_game.get(game_name, ()))
+            if statuses:
+                by_status = set()
+                for status in statuses:
+                    by_status |= self.rooms_by_status.get(status, set())
+                candidates = by_status if candidates is None else candidates & by_status
+            if candidates is None:
+                candidates = self.rooms.keys()
+
+            keyed = []
+            for room_id in candidates:
+                room = self.rooms[room_id]
+                if version is not None and room["version"] != version:
+                    continue
+                if has_slot and len(room["players"]) >= room["max_players"]:
+                    continue
+                keyed.append(((sort_key(room), room_id), room))
+            keyed.sort(key=lambda item: item[0], reverse=descending)
+
+            if after is not None:
+                if descending:
+                    keyed = [item for item in keyed if item[0] < after]
+                else:
+                    keyed = [item for item in keyed if item[0] > after]
+
+            page = keyed[:limit]
+            next_cursor = encode_cursor(sort, page[-1][0]) if len(keyed) > limit else None
+            return [self._project(room, fields) for _, room in page], next_cursor
+
+    def _project(self, room, fields):
+        if fields is None:
+            return dict(room)
+        out = {}
+        for f in fields:
+            if f == "player_count":
+                out[f] = len(room["players"])
+            elif f in room:
+                out[f] = room[f]
+        return out
+
+    def _index_room(self, room_id, room):
+        self.rooms_by_game.setdefault(room["game_name"], set()).add(room_id)
+        self.rooms_by_status.setdefault(room["status"], set()).add(room_id)
+
+    def _unindex_room(self, room_id, room):
+        for index, key in ((self.rooms_by_game, room["game_name"]), (self.rooms_by_status, room["status"])):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(room_id)
+                if not ids:
+                    del index[key]
+
+    def _drop_room(self, room_id):
+        self._unindex_room(room_id, self.rooms[room_id])
+        del self.rooms[room_id]
+
+    def _leave_current_room(self, username):
+        """加入 / 建立新房間前先離開原本所在的房間"""
+        if username in self.player_room:
+            self.leave_room(username)
+
     def remove_player_from_room(self, room_id, username):
         """內部使用，安全移除玩家"""
+        if self.player_room.get(username) == room_id:
+            del self.player_room[username]
         if room_id not in self.rooms:
             return
         if username in self.rooms[room_id]["players"]:
             self.rooms[room_id]["players"].remove(username)
 
     def get_room_of_player(self, username):
-        for room_id, data in self.rooms.items():
-            if username in data["players"]:
-                return room_id, data
-        return None, None
+        room_id = self.player_room.get(username)
+        if room_id is None:
+            return None, None
+        return room_id, self.rooms[room_id]
     
     def get_rooms(self):
         return self.rooms
@@ -105,8 +274,13 @@ class RoomManager:
         return self.rooms.get(room_id)
     
     def delete_room(self, room_id):
-        if room_id in self.rooms:
-            del self.rooms[room_id]
-            self._save()
-            return True
-        return False
+        with LOCK:
+            if room_id in self.rooms:
+                for username in self.rooms[room_id]["players"]:
+                    if self.player_room.get(username) == room_id:
+                        del self.player_room[username]
+                self._drop_room(room_id)
+                self._save(room_id)
+                self._emit("deleted", room_id)
+                return True
+            return False
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from room_manager import LOCK
+
+# ============================================================
+# 房間回收
+#   - game host 回報房間的遊戲 server 結束（room_finished）時，立即標記 finished 並釋放房間
+#   - 背景定期檢查：
+#       遊戲中的房間：遊戲 server 已不在任何 worker 上（例如 lobby 重啟前留下的），或超過遊戲時間上限
+#       等待中的房間：太久沒有玩家進出
+#       已結束卻還留著的房間
+#     遊戲 server 還在執行的房間會先請 worker 結束它，等收到 room_finished 才釋放房間
+#     房間已刪除、遊戲 server 卻還在執行的（例如刪除時遊戲正在啟動）也會被結束
+#     並結束閒置過久的 game host worker
+# ============================================================
+
+ROOM_IDLE_TIMEOUT = 600        # 等待中的房間多久沒有玩家進出就解散（秒）
+ROOM_MAX_LIFETIME = 2 * 3600   # 遊戲中的房間最長執行時間（秒）
+REAP_INTERVAL = 30             # 背景檢查間隔（秒）
+
+
+class RoomReaper:
+    def __init__(self, room_manager, game_hosts, idle_timeout=ROOM_IDLE_TIMEOUT,
+                 max_lifetime=ROOM_MAX_LIFETIME, interval=REAP_INTERVAL):
+        self.room_manager = room_manager
+        self.game_hosts = game_hosts
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stopping = {}  # room_id -> 回收原因；已請 worker 結束、等待 room_finished 的房間
+
+    def on_game_event(self, msg):
+        """GameHostPool 的 on_event：房間的遊戲 server 結束時釋放房間"""
+        if msg.get("event") == "room_finished":
+            reason = self.stopping.pop(msg["room_id"], None) or msg.get("error") or "遊戲結束"
+            self.room_manager.finish_room(msg["room_id"], reason)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        # 啟動時先清一次，之後定期檢查
+        while True:
+            try:
+                reaped = self.reap()
+                if reaped:
+                    print(f"[Reaper] 回收 {reaped} 間房間")
+            except Exception as e:
+                print(f"[Reaper] 檢查房間失敗: {e}")
+            if self.stop_event.wait(self.interval):
+                return
+
+    def reap(self):
+        """回收過期的房間，回傳直接釋放的數量（遊戲 server 還在執行的房間會在結束後才釋放）"""
+        now = time.time()
+        # 先取房間再取執行中的房間：狀態已是 running 的房間此時一定已登記在 worker 上
+        with LOCK:
+            rooms = [dict(room) for room in self.room_manager.rooms.values()]
+        active = self.game_hosts.active_rooms()
+
+        reaped = 0
+        for room in rooms:
+            reason = self._expired(room, now, active)
+            if reason is None:
+                continue
+            if room["room_id"] in active:
+                # 房間留著直到遊戲 server 真的結束（on_game_event）；沒結束的話下次檢查會再送一次
+                self.stopping[room["room_id"]] = reason
+                self.game_hosts.stop_room(room["room_id"])
+            elif self.room_manager.finish_room(room["room_id"], reason):
+                reaped += 1
+
+        # 執行中但房間已不存在的遊戲 server：房間一定在開始執行前就已建立，所以取完 active 後再看一次房間即可
+        with LOCK:
+            orphans = active - set(self.room_manager.rooms)
+        for room_id in orphans:
+            self.game_hosts.stop_room(room_id)
+
+        self.game_hosts.trim()
+        return reaped
+
+    def _expired(self, room, now, active):
+        """回傳回收原因；不需回收時回傳 None"""
+        status = room["status"]
+        if status == "finished":
+            return "遊戲已結束"
+        if status == "running":
+            if room["room_id"] not in active:
+                return "遊戲伺服器已結束"
+            started = room.get("started_at") or room.get("created_at") or 0
+            if now - started > self.max_lifetime:
+                return "超過遊戲時間上限"
+            return None
+        last_active = room.get("last_active") or room.get("created_at") or 0
+        if now - last_active > self.idle_timeout:
+            return "房間閒置過久"
+        return None
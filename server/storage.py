@@ -0,0 +1,405 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import atexit
+
+# ============================================================
+# 資料儲存後端
+#   - JsonStorage：原本的 JSON 檔案（帳號 / session 常駐記憶體並批次寫回，rooms.json，各遊戲的 reviews.json）
+#   - SqliteStorage：單一 SQLite 資料庫（WAL 模式），逐筆更新、有索引
+# AccountManager / RoomManager / lobby 的評論只透過這裡的 store 介面存取資料
+# 多 process：SQLite 後端的帳號 / session / 評論每次都直接查詢資料庫，可由多個 process 同時存取；
+#   房間則只在 RoomManager 啟動時載入一次，之後以記憶體為準（game host、房間事件、reaper 也都在同一個 process），
+#   store 只負責保存，因此同一時間只能有一個 lobby process
+# ============================================================
+
+ROOM_FILE = "rooms.json"
+UPLOAD_DIR = "uploaded_games"
+DB_FILE = "platform.db"
+FLUSH_INTERVAL = 1.0  # JSON 帳號檔寫入前累積變更的時間（秒）
+
+
+def atomic_write_json(path, text):
+    """先寫暫存檔再 rename，避免寫到一半當機留下壞掉的檔案（暫存檔名不重複，多個 thread 同時寫也不會互相干擾）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ------------------------------
+# JSON 後端
+# ------------------------------
+class JsonAccountStore:
+    """帳號與 session 常駐記憶體；變更只標記 dirty，由背景 thread 批次寫回檔案"""
+    def __init__(self, account_type):
+        self.filename = f"{account_type}_accounts.json"
+        self.session_file = f"{account_type}_sessions.json"
+
+        # 初始化檔案
+        for path in (self.filename, self.session_file):
+            if not os.path.exists(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump({}, f)
+
+        self.accounts = load_json(self.filename, {})
+        self.sessions = load_json(self.session_file, {})
+
+        self.lock = threading.RLock()
+        # 背景 thread、atexit 與直接呼叫的 flush 可能同時執行：依序寫檔，較舊的快照不會蓋掉較新的
+        self.write_lock = threading.Lock()
+        self._dirty = set()  # 待寫回的檔案："accounts" / "sessions"
+        self._dirty_event = threading.Event()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def _mark_dirty(self, name):
+        with self.lock:
+            self._dirty.add(name)
+        self._dirty_event.set()
+
+    def get_user(self, username):
+        return self.accounts.get(username)
+
+    def add_user(self, username, user):
+        with self.lock:
+            self.accounts[username] = user
+            self._mark_dirty("accounts")
+
+    def add_play_record(self, username, game_name, version):
+        with self.lock:
+            user = self.accounts.get(username)
+            if user is None:
+                return False
+            versions = user.setdefault("records", {}).setdefault(game_name, [])
+            if version not in versions:
+                versions.append(version)
+                self._mark_dirty("accounts")
+            return True
+
+    def has_played(self, username, game_name):
+        records = self.accounts.get(username, {}).get("records", {})
+        return game_name in records and len(records[game_name]) > 0
+
+    def has_session(self, username):
+        return username in self.sessions
+
+    def get_session(self, username):
+        return self.sessions.get(username, False)
+
+    def set_session(self, username, logged_in):
+        with self.lock:
+            self.sessions[username] = logged_in
+            self._mark_dirty("sessions")
+
+    def flush(self):
+        """立即把尚未寫回的變更存檔（self.lock 內只做序列化，寫檔在 self.lock 外、write_lock 內）"""
+        with self.write_lock:
+            with self.lock:
+                dirty, self._dirty = self._dirty, set()
+                texts = []
+                if "accounts" in dirty:
+                    texts.append(("accounts", self.filename, json.dumps(self.accounts, indent=2, ensure_ascii=False)))
+                if "sessions" in dirty:
+                    texts.append(("sessions", self.session_file, json.dumps(self.sessions, indent=2, ensure_ascii=False)))
+            for i, (name, path, text) in enumerate(texts):
+                try:
+                    atomic_write_json(path, text)
+                except OSError:
+                    # 寫入失敗：重新標記，下次再寫
+                    with self.lock:
+                        self._dirty.update(n for n, _, _ in texts[i:])
+                    raise
+
+    def _flush_loop(self):
+        while True:
+            self._dirty_event.wait()
+            # 等一小段時間，把這段期間的變更合併成一次寫入
+            time.sleep(FLUSH_INTERVAL)
+            self._dirty_event.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print("[Storage] 寫入檔案失敗:", e)
+
+
+class JsonRoomStore:
+    def __init__(self, path=ROOM_FILE):
+        self.path = path
+        # 若檔案不存在 → 建立空字典
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                json.dump({}, f, indent=2)
+
+    def load_all(self):
+        return load_json(self.path, {})
+
+    def save(self, rooms, room_id=None):
+        # JSON 檔只能整份重寫，room_id 不使用
+        atomic_write_json(self.path, json.dumps(rooms, indent=2))
+
+
+class JsonReviewStore:
+    def __init__(self, upload_dir=UPLOAD_DIR):
+        self.upload_dir = upload_dir
+        self.lock = threading.Lock()
+
+    def _path(self, game_name):
+        return os.path.join(self.upload_dir, game_name, "reviews.json")
+
+    def list(self, game_name):
+        return load_json(self._path(game_name), [])
+
+    def add(self, game_name, review):
+        with self.lock:
+            reviews = self.list(game_name)
+            reviews.append(review)
+            atomic_write_json(self._path(game_name), json.dumps(reviews, ensure_ascii=False))
+
+
+class JsonStorage:
+    name = "json"
+
+    def __init__(self, upload_dir=UPLOAD_DIR, room_file=ROOM_FILE):
+        self.upload_dir = upload_dir
+        self.room_file = room_file
+
+    def account_store(self, account_type):
+        return JsonAccountStore(account_type)
+
+    def room_store(self):
+        return JsonRoomStore(self.room_file)
+
+    def review_store(self):
+        return JsonReviewStore(self.upload_dir)
+
+
+# ------------------------------
+# SQLite 後端
+# ------------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    account_type TEXT NOT NULL,
+    username     TEXT NOT NULL,
+    password     TEXT NOT NULL,
+    PRIMARY KEY (account_type, username)
+);
+CREATE TABLE IF NOT EXISTS play_records (
+    account_type TEXT NOT NULL,
+    username     TEXT NOT NULL,
+    game_name    TEXT NOT NULL,
+    version      TEXT NOT NULL,
+    PRIMARY KEY (account_type, username, game_name, version)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    account_type TEXT NOT NULL,
+    username     TEXT NOT NULL,
+    logged_in    INTEGER NOT NULL,
+    PRIMARY KEY (account_type, username)
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id   TEXT PRIMARY KEY,
+    game_name TEXT,
+    status    TEXT,
+    data      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rooms_game_status ON rooms (game_name, status);
+CREATE TABLE IF NOT EXISTS reviews (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_name TEXT NOT NULL,
+    user      TEXT,
+    rating    INTEGER,
+    comment   TEXT
+);
+CREATE INDEX IF NOT EXISTS reviews_game ON reviews (game_name);
+"""
+
+
+class SqliteStorage:
+    name = "sqlite"
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.local = threading.local()  # sqlite3 連線不能跨 thread 共用，每個 thread 各開一條
+        conn = self.conn()
+        conn.executescript(SCHEMA)
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def account_store(self, account_type):
+        return SqliteAccountStore(self, account_type)
+
+    def room_store(self):
+        return SqliteRoomStore(self)
+
+    def review_store(self):
+        return SqliteReviewStore(self)
+
+    def migrate_from(self, source, account_types=("player", "developer")):
+        """一次性把 JSON 後端的資料匯入（已存在的資料不會被覆蓋）"""
+        conn = self.conn()
+        with conn:
+            for account_type in account_types:
+                if not os.path.exists(f"{account_type}_accounts.json"):
+                    continue
+                store = JsonAccountStore(account_type)
+                for username, user in store.accounts.items():
+                    conn.execute("INSERT OR IGNORE INTO accounts VALUES (?, ?, ?)",
+                                 (account_type, username, user.get("password", "")))
+                    for game_name, versions in user.get("records", {}).items():
+                        conn.executemany("INSERT OR IGNORE INTO play_records VALUES (?, ?, ?, ?)",
+                                         [(account_type, username, game_name, v) for v in versions])
+                # 舊的登入狀態沒有意義，匯入後一律視為登出
+                conn.executemany("INSERT OR IGNORE INTO sessions VALUES (?, ?, 0)",
+                                 [(account_type, username) for username in store.sessions])
+
+            for room_id, room in load_json(source.room_file, {}).items():
+                conn.execute("INSERT OR IGNORE INTO rooms VALUES (?, ?, ?, ?)",
+                             (room_id, room.get("game_name"), room.get("status"), json.dumps(room)))
+
+            if os.path.isdir(source.upload_dir):
+                reviews = JsonReviewStore(source.upload_dir)
+                for game_name in os.listdir(source.upload_dir):
+                    if conn.execute("SELECT 1 FROM reviews WHERE game_name = ? LIMIT 1", (game_name,)).fetchone():
+                        continue
+                    conn.executemany(
+                        "INSERT INTO reviews (game_name, user, rating, comment) VALUES (?, ?, ?, ?)",
+                        [(game_name, r.get("user"), r.get("rating"), r.get("comment", ""))
+                         for r in reviews.list(game_name)])
+
+
+class SqliteAccountStore:
+    def __init__(self, storage, account_type):
+        self.storage = storage
+        self.account_type = account_type
+
+    def get_user(self, username):
+        row = self.storage.conn().execute(
+            "SELECT password FROM accounts WHERE account_type = ? AND username = ?",
+            (self.account_type, username)).fetchone()
+        return {"password": row[0]} if row else None
+
+    def add_user(self, username, user):
+        conn = self.storage.conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)",
+                         (self.account_type, username, user["password"]))
+
+    def add_play_record(self, username, game_name, version):
+        if self.get_user(username) is None:
+            return False
+        conn = self.storage.conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO play_records VALUES (?, ?, ?, ?)",
+                         (self.account_type, username, game_name, version))
+        return True
+
+    def has_played(self, username, game_name):
+        row = self.storage.conn().execute(
+            "SELECT 1 FROM play_records WHERE account_type = ? AND username = ? AND game_name = ? LIMIT 1",
+            (self.account_type, username, game_name)).fetchone()
+        return row is not None
+
+    def _session_row(self, username):
+        return self.storage.conn().execute(
+            "SELECT logged_in FROM sessions WHERE account_type = ? AND username = ?",
+            (self.account_type, username)).fetchone()
+
+    def has_session(self, username):
+        return self._session_row(username) is not None
+
+    def get_session(self, username):
+        row = self._session_row(username)
+        return bool(row[0]) if row else False
+
+    def set_session(self, username, logged_in):
+        conn = self.storage.conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                         (self.account_type, username, int(logged_in)))
+
+    def flush(self):
+        pass
+
+
+class SqliteRoomStore:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def load_all(self):
+        rows = self.storage.conn().execute("SELECT room_id, data FROM rooms").fetchall()
+        return {room_id: json.loads(data) for room_id, data in rows}
+
+    def save(self, rooms, room_id=None):
+        """只寫入 room_id 這一列（房間已不在 rooms 中則刪除）；room_id 為 None 時整批同步"""
+        conn = self.storage.conn()
+        with conn:
+            if room_id is None:
+                conn.execute("DELETE FROM rooms")
+                targets = list(rooms)
+            else:
+                targets = [room_id]
+            for rid in targets:
+                room = rooms.get(rid)
+                if room is None:
+                    conn.execute("DELETE FROM rooms WHERE room_id = ?", (rid,))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?)",
+                                 (rid, room.get("game_name"), room.get("status"), json.dumps(room)))
+
+
+class SqliteReviewStore:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def list(self, game_name):
+        rows = self.storage.conn().execute(
+            "SELECT user, rating, comment FROM reviews WHERE game_name = ? ORDER BY id", (game_name,)).fetchall()
+        return [{"user": user, "rating": rating, "comment": comment} for user, rating, comment in rows]
+
+    def add(self, game_name, review):
+        conn = self.storage.conn()
+        with conn:
+            conn.execute("INSERT INTO reviews (game_name, user, rating, comment) VALUES (?, ?, ?, ?)",
+                         (game_name, review.get("user"), review.get("rating"), review.get("comment", "")))
+
+
+def open_storage(backend=None):
+    """backend："json"（預設）或 "sqlite"；未指定時讀環境變數 STORAGE_BACKEND"""
+    backend = backend or os.environ.get("STORAGE_BACKEND", "json")
+    if backend == "sqlite":
+        return SqliteStorage(os.environ.get("STORAGE_DB", DB_FILE))
+    return JsonStorage()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="把現有的 JSON 檔案匯入 SQLite")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    SqliteStorage(args.db).migrate_from(JsonStorage())
+    print(f"已匯入 {args.db}")